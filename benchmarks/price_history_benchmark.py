@@ -0,0 +1,108 @@
+"""
+Benchmark of the price history reshaping of /api/product/<uuid> against the previous shops x dates loop,
+on synthetic year-long histories: the rows Flux already pivoted (one record per day with one column per
+shop, utils/price_history.py) are turned into the prices matrix and the chart (utils/price_history_cache.py).
+
+Usage (from the repository root): python -m benchmarks.price_history_benchmark [shops] [days] [repeat]
+"""
+import datetime
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+from utils.price_history import price_history_rows
+from utils.price_history_cache import history_chart, rows_matrix
+
+
+def legacy_price_history_chart(df):
+    """
+    Previous implementation: a boolean mask over the whole frame for every shop and date.
+    """
+    labels = []
+    datasets = []
+
+    df_min_values = df.groupby(["_time", "shop"]).min().reset_index()
+    shop_counts = df.groupby(["shop"]).size().to_dict()
+    date_list = df_min_values["_time"].unique().tolist()
+
+    labels_check = False
+    for shop in shop_counts:
+        data_dict = {"label": shop, "data": []}
+        for date in date_list:
+            if not labels_check:
+                formatted_date = date.strftime("%Y-%m-%d")
+                if formatted_date not in labels:
+                    labels.append(formatted_date)
+
+            values = df_min_values.loc[(df_min_values["_time"] == date) & (df_min_values["shop"] == shop), "_value"]
+            if values.empty:
+                value = None
+            else:
+                value = values.iloc[0]
+
+            data_dict["data"].append(value)
+
+        labels_check = True
+        datasets.append(data_dict)
+
+    return {"labels": labels, "datasets": datasets}
+
+
+def synthetic_history(shops, days, seed=0):
+    """
+    Returns a frame like the Influx one after aggregateWindow(every: 1d, fn: min): one row per shop and
+    day, with 10% of the days missing for every shop.
+    """
+    rng = np.random.default_rng(seed)
+    start = datetime.datetime(2023, 1, 1, tzinfo=datetime.timezone.utc)
+    dates = pd.date_range(start, periods=days, freq="D")
+
+    frames = []
+    for shop in range(shops):
+        shop_dates = dates[rng.random(days) > 0.1]
+        prices = np.round(400 + rng.normal(0, 25, len(shop_dates)).cumsum() / 10, 2)
+        frames.append(pd.DataFrame({"_time": shop_dates, "shop": f"Shop {shop}", "_value": prices}))
+
+    return pd.concat(frames, ignore_index=True)
+
+
+class Record:
+    def __init__(self, values):
+        self.values = values
+
+
+def pivoted_records(df):
+    """
+    Returns the records the pivoted Flux query yields for the synthetic history.
+    """
+    pivot = df.pivot_table(index="_time", columns="shop", values="_value", aggfunc="min")
+    pivot = pivot.astype(object).where(pivot.notna(), None)
+    return [Record({"result": "prices", "table": 0, "_time": time, **row}) for time, row in zip(pivot.index, pivot.to_dict("records"))]
+
+
+def rows_chart(rows):
+    """
+    Current implementation: the rows read by price_history_rows() as a shops x days matrix, then the chart.
+    """
+    shops = sorted({shop for _, shop_prices in rows for shop, price in shop_prices.items() if price is not None})
+    days, prices = rows_matrix(rows, shops)
+    return history_chart(days, shops, prices)
+
+
+def main(shops=9, days=365, repeat=5):
+    df = synthetic_history(shops, days)
+    rows = list(price_history_rows(pivoted_records(df)))
+
+    assert rows_chart(rows) == legacy_price_history_chart(df), "Matrix and legacy charts differ"
+
+    legacy = min(timeit.repeat(lambda: legacy_price_history_chart(df), number=1, repeat=repeat))
+    matrix = min(timeit.repeat(lambda: rows_chart(rows), number=1, repeat=repeat))
+
+    print(f"{shops} shops x {days} days ({len(df)} rows)")
+    print(f"legacy: {legacy * 1000:9.2f} ms")
+    print(f"matrix: {matrix * 1000:9.2f} ms ({legacy / matrix:.1f}x)")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,76 @@
+"""
+Benchmark of the price history and opportunity reads on the embedded time series backend
+(database/timeseries.py, SQLiteTimeSeries), on a synthetic store of several prices per day of every
+product and shop. No InfluxDB nor PostgreSQL is needed.
+
+Usage (from the repository root): python -m benchmarks.timeseries_benchmark [products] [shops] [days] [repeat]
+"""
+import datetime
+import os
+import sys
+import tempfile
+import timeit
+import uuid
+from contextlib import closing
+
+import numpy as np
+from database.timeseries import SQLiteTimeSeries
+from utils.price_history_cache import PriceHistoryCache
+
+## Prices saved per product, shop and day
+SAMPLES_PER_DAY = 4
+
+
+def synthetic_prices(products, shops, days, seed=0):
+    """
+    Yields (uuid, shop, time, price) of random walks ending now, 10% of the days without prices.
+    """
+    rng = np.random.default_rng(seed)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    hours = 24 // SAMPLES_PER_DAY
+
+    for _ in range(products):
+        product_uuid = str(uuid.uuid4())
+        for shop in range(shops):
+            prices = np.round(400 + rng.normal(0, 5, days * SAMPLES_PER_DAY).cumsum(), 2)
+            with_price = np.repeat(rng.random(days) > 0.1, SAMPLES_PER_DAY)
+            for sample in np.flatnonzero(with_price).tolist():
+                time = now - datetime.timedelta(hours=(days * SAMPLES_PER_DAY - sample) * hours)
+                yield product_uuid, f"Shop {shop}", time, float(prices[sample])
+
+
+def main(products=200, shops=9, days=365, repeat=5):
+    with tempfile.TemporaryDirectory() as directory:
+        store = SQLiteTimeSeries(os.path.join(directory, "prices.sqlite3"))
+
+        start = timeit.default_timer()
+        store.write(synthetic_prices(products, shops, days))
+        print(f"{products} products x {shops} shops x {days} days: store written in {timeit.default_timer() - start:.2f}s")
+
+        with closing(store.connect()) as connection:
+            product_uuid = connection.execute("SELECT uuid FROM prices LIMIT 1").fetchone()[0]
+
+        def fetch(start):
+            return store.daily_min_by_shop(product_uuid, datetime.datetime.combine(start, datetime.time(), tzinfo=datetime.timezone.utc))
+
+        daily = min(timeit.repeat(lambda: fetch(datetime.date.today() - datetime.timedelta(days=days)), number=1, repeat=repeat))
+
+        # A cold history reads every day, a warm one only the current day
+        cold = min(timeit.repeat(lambda: PriceHistoryCache(1).get_history(product_uuid, fetch, days), number=1, repeat=repeat))
+        cache = PriceHistoryCache(1)
+        cache.get_history(product_uuid, fetch, days)
+        warm = min(timeit.repeat(lambda: cache.get_history(product_uuid, fetch, days), number=1, repeat=repeat))
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        window = min(timeit.repeat(lambda: store.min_by_uuid(now - datetime.timedelta(days=7), now - datetime.timedelta(days=1)), number=1, repeat=repeat))
+        current = min(timeit.repeat(lambda: store.current_min_by_uuid(now - datetime.timedelta(days=1)), number=1, repeat=repeat))
+
+    print(f"daily min by shop:   {daily * 1000:9.2f} ms")
+    print(f"history (cold):      {cold * 1000:9.2f} ms")
+    print(f"history (warm):      {warm * 1000:9.2f} ms")
+    print(f"7 day min by uuid:   {window * 1000:9.2f} ms")
+    print(f"current min by uuid: {current * 1000:9.2f} ms")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
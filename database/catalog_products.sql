@@ -0,0 +1,183 @@
+-- Per-category catalog aggregate served by /api/category/<category> and /api/categories/<category>
+-- Each row holds everything both endpoints need from a product, so they no longer join
+-- products, specs, shops, manufacturers and products_availabilities on every request.
+--
+-- Triggers queue the products whose rows changed in catalog_products_dirty and
+-- refresh_catalog_products() only recomputes those. Full rebuild: SELECT refresh_catalog_products(TRUE);
+-- Requires database/product_specs_documents.sql
+
+CREATE TABLE IF NOT EXISTS catalog_products (
+    product_id INTEGER PRIMARY KEY REFERENCES products(_id) ON DELETE CASCADE,
+    category TEXT,
+    uuid TEXT NOT NULL,
+    name TEXT,
+    refurbished BOOLEAN,
+    deleted BOOLEAN,
+    image TEXT,
+    manufacturer TEXT,
+    specs JSONB,                        -- {spec name: value}, NULL when the product has no specs
+    shops JSONB,                        -- shop of every availability
+    shops_min_price NUMERIC,            -- min price of every availability
+    availabilities JSONB,               -- [{shopName, url, price}] of non deleted availabilities ordered by price
+    availabilities_min_price NUMERIC,   -- min price of non deleted availabilities
+    in_stock_price NUMERIC,             -- min price in stock (NULL if none > 0)
+    out_of_stock_price NUMERIC,         -- min price out of stock (NULL if none > 0)
+    price NUMERIC,                      -- in stock price, otherwise out of stock price
+    stock INTEGER,                      -- 1 in stock, 0 out of stock
+    refreshed_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+-- Keyset pagination on (price, uuid) of /api/category and /api/categories
+CREATE INDEX IF NOT EXISTS catalog_products_category_price_idx ON catalog_products (category, price, uuid);
+CREATE INDEX IF NOT EXISTS catalog_products_category_price_desc_idx ON catalog_products (category, price DESC NULLS LAST, uuid DESC);
+CREATE INDEX IF NOT EXISTS catalog_products_category_min_price_idx ON catalog_products (category, availabilities_min_price, uuid);
+-- Manufacturer filter of /api/category (?manufacturer=)
+CREATE INDEX IF NOT EXISTS catalog_products_category_manufacturer_idx ON catalog_products (category, manufacturer, price, uuid);
+
+CREATE TABLE IF NOT EXISTS catalog_products_dirty (
+    product_id INTEGER PRIMARY KEY
+);
+
+-- Catalog version stamp: bumped by every refresh that changed something and by telegram_channels writes.
+-- ETags and response cache keys are derived from it.
+CREATE TABLE IF NOT EXISTS catalog_version (
+    _id INTEGER PRIMARY KEY DEFAULT 1 CHECK (_id = 1),
+    version BIGINT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP NOT NULL DEFAULT now()
+);
+INSERT INTO catalog_version (_id) VALUES (1) ON CONFLICT DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_catalog_version() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE catalog_version SET version = version + 1, updated_at = now() WHERE _id = 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS catalog_version_tc ON telegram_channels;
+CREATE TRIGGER catalog_version_tc AFTER INSERT OR UPDATE OR DELETE ON telegram_channels
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version();
+
+
+CREATE OR REPLACE FUNCTION mark_catalog_product_dirty() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'products' THEN
+        INSERT INTO catalog_products_dirty (product_id) VALUES (NEW._id) ON CONFLICT DO NOTHING;
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO catalog_products_dirty (product_id) VALUES (OLD.product_id) ON CONFLICT DO NOTHING;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO catalog_products_dirty (product_id) VALUES (NEW.product_id) ON CONFLICT DO NOTHING;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Scrapers rewrite rows with the same values, those updates must not queue anything
+DROP TRIGGER IF EXISTS catalog_products_dirty_pa ON products_availabilities;
+CREATE TRIGGER catalog_products_dirty_pa AFTER INSERT OR DELETE ON products_availabilities
+    FOR EACH ROW EXECUTE FUNCTION mark_catalog_product_dirty();
+DROP TRIGGER IF EXISTS catalog_products_dirty_pa_update ON products_availabilities;
+CREATE TRIGGER catalog_products_dirty_pa_update AFTER UPDATE ON products_availabilities
+    FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*) EXECUTE FUNCTION mark_catalog_product_dirty();
+
+-- Specs are followed through their documents, which also change when a spec is renamed
+DROP TRIGGER IF EXISTS catalog_products_dirty_ps ON product_specs;
+DROP TRIGGER IF EXISTS catalog_products_dirty_ps_update ON product_specs;
+DROP TRIGGER IF EXISTS catalog_products_dirty_psd ON product_specs_documents;
+CREATE TRIGGER catalog_products_dirty_psd AFTER INSERT OR DELETE ON product_specs_documents
+    FOR EACH ROW EXECUTE FUNCTION mark_catalog_product_dirty();
+DROP TRIGGER IF EXISTS catalog_products_dirty_psd_update ON product_specs_documents;
+CREATE TRIGGER catalog_products_dirty_psd_update AFTER UPDATE ON product_specs_documents
+    FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*) EXECUTE FUNCTION mark_catalog_product_dirty();
+
+DROP TRIGGER IF EXISTS catalog_products_dirty_p ON products;
+CREATE TRIGGER catalog_products_dirty_p AFTER INSERT ON products
+    FOR EACH ROW EXECUTE FUNCTION mark_catalog_product_dirty();
+DROP TRIGGER IF EXISTS catalog_products_dirty_p_update ON products;
+CREATE TRIGGER catalog_products_dirty_p_update AFTER UPDATE ON products
+    FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*) EXECUTE FUNCTION mark_catalog_product_dirty();
+
+
+CREATE OR REPLACE FUNCTION refresh_catalog_products(full_refresh BOOLEAN DEFAULT FALSE) RETURNS INTEGER AS $$
+DECLARE
+    dirty_ids INTEGER[];
+    refreshed INTEGER;
+BEGIN
+    -- Only one refresh at a time, the others have nothing left to do
+    IF NOT pg_try_advisory_xact_lock(hashtext('refresh_catalog_products')) THEN
+        RETURN 0;
+    END IF;
+
+    IF full_refresh THEN
+        INSERT INTO catalog_products_dirty (product_id) SELECT _id FROM products ON CONFLICT DO NOTHING;
+    END IF;
+
+    WITH dirty AS (DELETE FROM catalog_products_dirty RETURNING product_id)
+    SELECT array_agg(product_id) INTO dirty_ids FROM dirty;
+
+    IF dirty_ids IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    DELETE FROM catalog_products WHERE product_id = ANY(dirty_ids);
+
+    INSERT INTO catalog_products (
+        product_id, category, uuid, name, refurbished, deleted, image, manufacturer, specs,
+        shops, shops_min_price, availabilities, availabilities_min_price,
+        in_stock_price, out_of_stock_price, price, stock
+    )
+    SELECT
+        p._id, c.name, p.uuid::text, p.name, p.refurbished, p.deleted,
+        COALESCE(p.images#>>'{medium, 0}', p.images#>>'{large, 0}'),
+        m.name, ps.specs,
+        pa_sh.shops, pa_sh.min_price, pa.availabilities, pa.min_price,
+        pa_in.price, pa_out.price, COALESCE(pa_in.price, pa_out.price),
+        CASE WHEN pa_in.price IS NOT NULL THEN 1 WHEN pa_out.price IS NOT NULL THEN 0 END
+
+    FROM products p
+    LEFT JOIN categories c ON p.category_id = c._id
+    LEFT JOIN manufacturers m ON p.manufacturer_id = m._id
+    LEFT JOIN product_specs_documents ps ON ps.product_id = p._id
+    LEFT JOIN LATERAL (
+        SELECT jsonb_agg(sh.name) AS shops, MIN(pa_sh.price) AS min_price
+        FROM products_availabilities pa_sh
+        LEFT JOIN shops sh ON sh._id = pa_sh.shop_id
+        WHERE pa_sh.product_id = p._id
+        ) pa_sh ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT
+        jsonb_agg(jsonb_build_object('shopName', sh.name, 'url', pa.url, 'price', pa.price) ORDER BY pa.price) AS availabilities,
+        MIN(pa.price) AS min_price
+        FROM products_availabilities pa
+        LEFT JOIN shops sh ON sh._id = pa.shop_id
+        WHERE pa.product_id = p._id AND pa.deleted = FALSE
+        ) pa ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT MIN(pa_in.price) AS price
+        FROM products_availabilities pa_in
+        WHERE pa_in.product_id = p._id AND pa_in.stock = TRUE
+        HAVING MIN(pa_in.price) > 0
+        ) pa_in ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT MIN(pa_out.price) AS price
+        FROM products_availabilities pa_out
+        WHERE pa_out.product_id = p._id AND pa_out.stock = FALSE
+        HAVING MIN(pa_out.price) > 0
+        ) pa_out ON TRUE
+
+    WHERE p._id = ANY(dirty_ids);
+
+    GET DIAGNOSTICS refreshed = ROW_COUNT;
+
+    -- Deleted products refresh no row but still change the catalog
+    UPDATE catalog_version SET version = version + 1, updated_at = now() WHERE _id = 1;
+    RETURN refreshed;
+END;
+$$ LANGUAGE plpgsql;
+
+
+SELECT refresh_catalog_products(TRUE);
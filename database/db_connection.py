@@ -1,8 +1,19 @@
+import logging
 import os
-import socket
+import threading
+import time
+from contextlib import contextmanager
 
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
+import psycopg2.pool
+from sqlalchemy import create_engine
+from sqlalchemy.engine import URL
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.propagate = True
 
 HOSTNAME = os.environ.get("HOSTNAME", False)
 DATABASE = os.environ.get("POSGRESQL_DATABASE")
@@ -17,13 +28,281 @@ REMOTE_USER_PASSWORD = os.environ.get("POSGRESQL_REMOTE_USER_PASSWORD")
 REMOTE_URL = os.environ.get("POSGRESQL_REMOTE_URL")
 REMOTE_PORT = os.environ.get("POSGRESQL_REMOTE_PORT")
 
+## Pool settings (per gunicorn worker)
+POOL_MIN_SIZE = int(os.environ.get("POSGRESQL_POOL_MIN_SIZE", 1))
+POOL_MAX_SIZE = int(os.environ.get("POSGRESQL_POOL_MAX_SIZE", 10))
+POOL_TIMEOUT = float(os.environ.get("POSGRESQL_POOL_TIMEOUT", 5))  # Seconds
+POOL_HEALTH_CHECK_INTERVAL = float(os.environ.get("POSGRESQL_POOL_HEALTH_CHECK_INTERVAL", 30))  # Seconds
+## SQLAlchemy pool of the ORM writes on the primary (next to the psycopg2 pool)
+PRIMARY_ORM_POOL_SIZE = int(os.environ.get("POSGRESQL_PRIMARY_ORM_POOL_SIZE", 2))
+
+## Read/write routing: writes always go to the primary, catalog reads to the replica (if any)
+PRIMARY = os.environ.get("POSGRESQL_PRIMARY", "LOCAL" if HOSTNAME == "Docker" else "REMOTE")
+REPLICA = os.environ.get("POSGRESQL_REPLICA", "")
+REPLICA_MAX_LAG = float(os.environ.get("POSGRESQL_REPLICA_MAX_LAG", 30))  # Seconds
+REPLICA_LAG_CHECK_INTERVAL = float(os.environ.get("POSGRESQL_REPLICA_LAG_CHECK_INTERVAL", 5))  # Seconds
+
+ENDPOINTS = {
+    "LOCAL": {"user": LOCAL_USER, "password": LOCAL_USER_PASSWORD, "host": LOCAL_URL, "port": LOCAL_PORT, "database": DATABASE},
+    "REMOTE": {"user": REMOTE_USER, "password": REMOTE_USER_PASSWORD, "host": REMOTE_URL, "port": REMOTE_PORT, "database": DATABASE},
+}
+
+# A replica with nothing left to replay is not lagging, even if the last replayed transaction is old
+REPLICA_LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+    """
+
+
+class PoolTimeoutError(psycopg2.pool.PoolError):
+    pass
+
+
+class ConnectionPool:
+    """
+    Thread safe pool of psycopg2 connections.
+
+    Connections are checked out with a timeout and checked before being handed out:
+    broken connections are discarded (until a healthy one is found) and idle ones are pinged with SELECT 1.
+    """
+
+    def __init__(self, min_size, max_size, timeout, health_check_interval, **connect_kwargs):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._pool = psycopg2.pool.ThreadedConnectionPool(min_size, max_size, **connect_kwargs)
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._last_used = {}
+
+    def getconn(self, timeout=None):
+        """
+        :param timeout: seconds to wait for a free connection, the pool timeout by default (0 does not wait)
+        """
+        timeout = self.timeout if timeout is None else timeout
+        if not self._slots.acquire(timeout=timeout):
+            raise PoolTimeoutError(f"No database connection available after {timeout} seconds")
+
+        try:
+            # After a database restart every idle connection is broken: they are discarded until a healthy
+            # one is found or the pool opens a new one
+            for _ in range(self.max_size + 1):
+                connection = self._pool.getconn()
+                if self._is_healthy(connection):
+                    return connection
+
+                logger.warning("Se descarta una conexión rota del pool")
+                self._discard(connection)
+
+            raise psycopg2.OperationalError("No hay ninguna conexión sana en el pool")
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, connection):
+        close = bool(connection.closed)
+        if not close:
+            try:
+                if connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+            except psycopg2.Error:
+                close = True
+
+        if close:
+            self._last_used.pop(id(connection), None)
+        else:
+            self._last_used[id(connection)] = time.monotonic()
+
+        self._pool.putconn(connection, close=close)
+        self._slots.release()
+
+    def closeall(self):
+        self._pool.closeall()
+        self._last_used.clear()
+
+    def _discard(self, connection):
+        self._last_used.pop(id(connection), None)
+        self._pool.putconn(connection, close=True)
+
+    def _is_healthy(self, connection):
+        if connection.closed:
+            return False
+
+        if connection.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+
+        last_used = self._last_used.get(id(connection))
+        if last_used is not None and time.monotonic() - last_used < self.health_check_interval:
+            return True
+
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+        except psycopg2.Error:
+            return False
+
+        return True
+
+
+def connection_settings(endpoint=None):
+    """
+    Returns the psycopg2 connection arguments of a database endpoint.
+
+    :param endpoint: "LOCAL" or "REMOTE", the primary by default
+    :return: dict of connection arguments
+    """
+    return ENDPOINTS[endpoint or PRIMARY]
+
+
+_pools = {}
+_pools_pid = None
+_pools_lock = threading.Lock()
+
+_replica_usable = False
+_replica_checked_at = None
+_replica_lock = threading.Lock()
+
+_engine = None
+_engine_pid = None
+
+
+def get_pool(role="primary"):
+    """
+    Returns the connection pool of the current process for the primary or the replica.
+    Pools are created lazily so every gunicorn worker owns its connections (nothing is shared across fork).
+
+    :param role: "primary" or "replica"
+    :return: ConnectionPool
+    """
+    global _pools, _pools_pid
+
+    pid = os.getpid()
+    if _pools_pid == pid and role in _pools:
+        return _pools[role]
+
+    with _pools_lock:
+        if _pools_pid != pid:
+            _pools = {}
+            _pools_pid = pid
+
+        if role not in _pools:
+            endpoint = REPLICA if role == "replica" else PRIMARY
+            _pools[role] = ConnectionPool(POOL_MIN_SIZE, POOL_MAX_SIZE, POOL_TIMEOUT, POOL_HEALTH_CHECK_INTERVAL, **connection_settings(endpoint))
+
+    return _pools[role]
+
+
+def _set_replica_usable(usable):
+    global _replica_usable, _replica_checked_at
+
+    _replica_usable = usable
+    _replica_checked_at = time.monotonic()
+
+
+def replica_is_usable():
+    """
+    Returns whether catalog reads can be sent to the replica.
+    The replication lag is checked at most once every REPLICA_LAG_CHECK_INTERVAL seconds.
+
+    :return: bool
+    """
+    if not REPLICA or REPLICA == PRIMARY:
+        return False
+
+    if _replica_checked_at is not None and time.monotonic() - _replica_checked_at < REPLICA_LAG_CHECK_INTERVAL:
+        return _replica_usable
+
+    # Another thread is already checking, keep the previous answer
+    if not _replica_lock.acquire(blocking=False):
+        return _replica_usable
+
+    try:
+        pool = get_pool("replica")
+        # The probe never waits for a saturated pool
+        connection = pool.getconn(timeout=0)
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(REPLICA_LAG_QUERY)
+                lag = float(cursor.fetchone()[0])
+        finally:
+            pool.putconn(connection)
+
+        if lag > REPLICA_MAX_LAG:
+            logger.warning(f"La réplica va {lag:.1f}s por detrás, las lecturas se envían al primario")
+        _set_replica_usable(lag <= REPLICA_MAX_LAG)
+    except PoolTimeoutError:
+        # A saturated pool is not a dead replica: this read goes to the primary (the checkout would wait too)
+        # and the lag is checked again on the next call
+        logger.warning("Pool de la réplica saturado, no se ha podido comprobar el retraso")
+        return False
+    except psycopg2.Error as e:
+        logger.warning(f"Réplica no disponible, las lecturas se envían al primario: {e}")
+        _set_replica_usable(False)
+    finally:
+        _replica_lock.release()
+
+    return _replica_usable
+
+
+@contextmanager
+def sql_connection(readonly=False):
+    """
+    Checks out a connection from the worker pool and returns it to the pool on exit.
+    Any transaction left open is rolled back.
+
+    :param readonly: the caller only reads catalog data, so the replica can serve it
+    """
+    pool = None
+    connection = None
+    if readonly and replica_is_usable():
+        try:
+            pool = get_pool("replica")
+            connection = pool.getconn()
+        except PoolTimeoutError:
+            # Only this read goes to the primary, the replica keeps serving the rest
+            logger.warning("Pool de la réplica saturado, la lectura se envía al primario")
+        except psycopg2.Error as e:
+            logger.warning(f"Réplica no disponible, las lecturas se envían al primario: {e}")
+            _set_replica_usable(False)
+
+    if connection is None:
+        pool = get_pool("primary")
+        connection = pool.getconn()
+
+    try:
+        yield connection
+    finally:
+        pool.putconn(connection)
+
+
+def primary_engine():
+    """
+    Returns the SQLAlchemy engine of the primary for the current process.
+    ORM sessions that write must be bound to it: Session(bind=primary_engine())
+
+    :return: sqlalchemy Engine
+    """
+    global _engine, _engine_pid
+
+    pid = os.getpid()
+    if _engine is not None and _engine_pid == pid:
+        return _engine
 
-def sql_connection():
-    if HOSTNAME == "Docker":
-        # Localhost / Docker
-        connection = psycopg2.connect(user=LOCAL_USER, password=LOCAL_USER_PASSWORD, host=LOCAL_URL, port=LOCAL_PORT, database=DATABASE)
-    else:
-        # Remote Host
-        connection = psycopg2.connect(user=REMOTE_USER, password=REMOTE_USER_PASSWORD, host=REMOTE_URL, port=REMOTE_PORT, database=DATABASE)
+    with _pools_lock:
+        if _engine is None or _engine_pid != pid:
+            settings = connection_settings(PRIMARY)
+            url = URL.create(
+                "postgresql+psycopg2",
+                username=settings["user"],
+                password=settings["password"],
+                host=settings["host"],
+                port=int(settings["port"]) if settings["port"] else None,
+                database=settings["database"],
+            )
+            _engine = create_engine(url, pool_size=PRIMARY_ORM_POOL_SIZE, max_overflow=0, pool_timeout=POOL_TIMEOUT, pool_pre_ping=True)
+            _engine_pid = pid
 
-    return connection
+    return _engine
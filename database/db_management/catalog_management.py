@@ -0,0 +1,587 @@
+import fcntl
+import logging
+import os
+import shutil
+import threading
+import time
+
+import psycopg2
+import psycopg2.extras
+from database.db_connection import sql_connection
+from utils.catalog_snapshot import CatalogSnapshot
+from utils.gpu_taxonomy import GpuTaxonomy
+from utils.ngram_index import WORD_REGEX, NgramIndex
+from utils.pagination import encode_cursor
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.propagate = True
+
+CATALOG_REFRESH_ENABLED = os.environ.get("CATALOG_REFRESH_ENABLED", "1") == "1"
+CATALOG_REFRESH_INTERVAL = float(os.environ.get("CATALOG_REFRESH_INTERVAL", 60))  # Seconds
+CATALOG_VERSION_CHECK_INTERVAL = float(os.environ.get("CATALOG_VERSION_CHECK_INTERVAL", 2))  # Seconds
+CATALOG_SNAPSHOT_ENABLED = os.environ.get("CATALOG_SNAPSHOT_ENABLED", "1") == "1"
+CATALOG_SNAPSHOT_DIR = os.environ.get("CATALOG_SNAPSHOT_DIR", "")  # Shared by the workers, e.g. /dev/shm/catalog_snapshot
+
+SNAPSHOT_CURRENT_LINK = "current"
+SNAPSHOT_LOCK_FILE = ".lock"
+
+GPU_MODEL_SPEC_ID = 3
+
+## Products returned by /api/search
+SEARCH_PRODUCT_STR = "json_build_object('uuid', cp.uuid, 'name', cp.name, 'category', cp.category, 'image', cp.image, 'price', cp.price, 'stock', cp.stock)"
+SEARCH_WHERE_STR = "WHERE cp.deleted = FALSE AND cp.shops_min_price > 0"
+
+_refresher_started = False
+_refresh_lock = threading.Lock()
+
+_catalog_version = None
+_version_checked_at = None
+
+_gpu_taxonomy = None
+_gpu_taxonomy_version = None
+
+_numeric_facets = None
+_numeric_facets_version = None
+
+_trigram_search = None
+_trigram_search_version = None
+_ngram_index = None
+_ngram_indexer_started = False
+
+_catalog_snapshot = None
+_snapshot_lock = threading.Lock()
+_snapshot_loading = False
+_mapped_generation = None
+
+
+def refresh_catalog_products(full_refresh=False):
+    """
+    Recomputes the catalog_products rows of the products whose availabilities, specs or data changed.
+    It always runs on the primary (see database/catalog_products.sql).
+
+    :param full_refresh: recompute every product
+    :return: number of products refreshed
+    """
+    with sql_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT refresh_catalog_products(%s)", (full_refresh,))
+            refreshed = cursor.fetchone()[0]
+        connection.commit()
+
+    if refreshed:
+        logger.info(f"Se han actualizado {refreshed} productos del catálogo")
+    return refreshed
+
+
+def catalog_refresher():
+    """
+    Refreshes the catalog aggregate every CATALOG_REFRESH_INTERVAL seconds, out of the requests.
+    Errors are logged, the endpoints keep serving the last refreshed data.
+    """
+    while True:
+        try:
+            refresh_catalog_products()
+        except Exception as e:
+            logger.error(f"No se ha podido actualizar el catálogo: {e}")
+
+        time.sleep(CATALOG_REFRESH_INTERVAL)
+
+
+def start_catalog_refresher():
+    """
+    Starts the refresh thread of the catalog aggregate in the worker (read endpoints never write).
+    The refresh takes an advisory lock, so only one worker refreshes at a time.
+    Disabled with CATALOG_REFRESH_ENABLED=0 when the scrapers call refresh_catalog_products() themselves.
+    """
+    global _refresher_started
+
+    with _refresh_lock:
+        if not CATALOG_REFRESH_ENABLED or _refresher_started:
+            return
+        _refresher_started = True
+
+    threading.Thread(target=catalog_refresher, daemon=True).start()
+
+
+def get_catalog_version():
+    """
+    Returns the catalog version stamp (database/catalog_products.sql), read at most once every
+    CATALOG_VERSION_CHECK_INTERVAL seconds per worker.
+
+    :return: int or None if it could not be read
+    """
+    global _catalog_version, _version_checked_at
+
+    now = time.monotonic()
+    if _version_checked_at is not None and now - _version_checked_at < CATALOG_VERSION_CHECK_INTERVAL:
+        return _catalog_version
+
+    try:
+        with sql_connection(readonly=True) as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT version FROM catalog_version WHERE _id = 1")
+                row = cursor.fetchone()
+        _catalog_version = row[0] if row else None
+    except psycopg2.Error as e:
+        logger.error(f"No se ha podido leer la versión del catálogo: {e}")
+
+    _version_checked_at = now
+    return _catalog_version
+
+
+def get_gpu_taxonomy():
+    """
+    Returns the GPU taxonomy of the catalog (every GPU model spec value and its normalized model).
+    It is rebuilt only when the catalog version changes.
+
+    :return: GpuTaxonomy
+    """
+    global _gpu_taxonomy, _gpu_taxonomy_version
+
+    version = get_catalog_version()
+    if _gpu_taxonomy is not None and version is not None and version == _gpu_taxonomy_version:
+        return _gpu_taxonomy
+
+    with sql_connection(readonly=True) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT DISTINCT value FROM product_specs WHERE spec_id = %s", (GPU_MODEL_SPEC_ID,))
+            values = [row[0] for row in cursor.fetchall()]
+
+    _gpu_taxonomy = GpuTaxonomy(values)
+    _gpu_taxonomy_version = version
+    return _gpu_taxonomy
+
+
+def get_numeric_facets(category):
+    """
+    Returns the numeric facets defined for a category (database/product_numeric_specs.sql).
+    The definitions are read again only when the catalog version changes.
+
+    :param category: category name
+    :return: tuple of facet names
+    """
+    global _numeric_facets, _numeric_facets_version
+
+    version = get_catalog_version()
+    if _numeric_facets is None or version is None or version != _numeric_facets_version:
+        numeric_facets = {}
+        with sql_connection(readonly=True) as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT category, facet FROM numeric_spec_facets ORDER BY 1, 2")
+                for row in cursor.fetchall():
+                    numeric_facets[row[0]] = numeric_facets.get(row[0], ()) + (row[1],)
+
+        _numeric_facets = numeric_facets
+        _numeric_facets_version = version
+
+    return _numeric_facets.get(category, ())
+
+
+def load_catalog_snapshot():
+    """
+    Reads the whole catalog in a single repeatable read transaction, so products, availabilities,
+    facets and the version stamp are consistent.
+
+    :return: CatalogSnapshot
+    """
+    products_query = """
+        SELECT
+        cp.product_id, cp.category, cp.uuid, cp.name, cp.refurbished, cp.deleted, cp.image, cp.manufacturer,
+        cp.specs, cp.shops, cp.shops_min_price::float8, cp.availabilities, cp.availabilities_min_price::float8,
+        cp.price::float8, cp.stock,
+        (SELECT ps.value FROM product_specs ps WHERE ps.product_id = cp.product_id AND ps.spec_id = %s LIMIT 1)
+        FROM catalog_products cp
+        ORDER BY cp.product_id
+        """
+
+    availabilities_query = f"""
+        SELECT pa.product_id, sh.name, pa.price::float8
+        FROM products_availabilities pa
+        JOIN shops sh ON sh._id = pa.shop_id
+        WHERE pa.deleted = {False} AND pa.stock = {True} AND pa.price > 0 AND pa.code > 0
+        """
+
+    start = time.monotonic()
+    with sql_connection(readonly=True) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+            cursor.execute("SELECT version FROM catalog_version WHERE _id = 1")
+            row = cursor.fetchone()
+            version = row[0] if row else None
+
+            cursor.execute(products_query, (GPU_MODEL_SPEC_ID,))
+            products = cursor.fetchall()
+            cursor.execute(availabilities_query)
+            availabilities = cursor.fetchall()
+            cursor.execute("SELECT product_id, facet, value FROM product_numeric_specs")
+            facets = cursor.fetchall()
+        connection.rollback()
+
+    snapshot = CatalogSnapshot.from_rows(version, products, availabilities, facets)
+    logger.info(f"Snapshot del catálogo {version}: {len(snapshot)} productos en {time.monotonic() - start:.2f}s")
+    return snapshot
+
+
+def map_shared_snapshot():
+    """
+    Returns the current generation of the shared snapshot (CATALOG_SNAPSHOT_DIR), memory mapped read-only.
+    A generation already mapped by this worker is not mapped again.
+
+    :return: CatalogSnapshot or None if no generation has been published
+    """
+    global _mapped_generation
+
+    generation = os.path.realpath(os.path.join(CATALOG_SNAPSHOT_DIR, SNAPSHOT_CURRENT_LINK))
+    if not os.path.isdir(generation):
+        return None
+    if generation == _mapped_generation and _catalog_snapshot is not None:
+        return _catalog_snapshot
+
+    snapshot = CatalogSnapshot.load(generation)
+    _mapped_generation = generation
+    return snapshot
+
+
+def publish_shared_snapshot(snapshot):
+    """
+    Saves the snapshot as a new generation of CATALOG_SNAPSHOT_DIR and atomically points the current
+    link to it. Workers still mapping older generations keep their pages until they map the new one.
+
+    :param snapshot: CatalogSnapshot
+    """
+    generation = f"generation-{snapshot.version}-{time.time_ns()}"
+    os.makedirs(os.path.join(CATALOG_SNAPSHOT_DIR, generation))
+    snapshot.save(os.path.join(CATALOG_SNAPSHOT_DIR, generation))
+
+    link = os.path.join(CATALOG_SNAPSHOT_DIR, f".{SNAPSHOT_CURRENT_LINK}-{os.getpid()}")
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(generation, link)
+    os.replace(link, os.path.join(CATALOG_SNAPSHOT_DIR, SNAPSHOT_CURRENT_LINK))
+
+    # The previous generation is kept for the workers resolving the link right now
+    generations = sorted(
+        (entry for entry in os.listdir(CATALOG_SNAPSHOT_DIR) if entry.startswith("generation-")),
+        key=lambda entry: os.path.getmtime(os.path.join(CATALOG_SNAPSHOT_DIR, entry)),
+    )
+    for old_generation in generations[:-2]:
+        shutil.rmtree(os.path.join(CATALOG_SNAPSHOT_DIR, old_generation), ignore_errors=True)
+
+
+def load_shared_snapshot(version):
+    """
+    Returns the shared snapshot of the catalog version. Workers take the builder lock in turns:
+    the first one builds and publishes the generation, the others find it published and just map it.
+
+    :param version: catalog version needed
+    :return: CatalogSnapshot
+    """
+    os.makedirs(CATALOG_SNAPSHOT_DIR, exist_ok=True)
+    with open(os.path.join(CATALOG_SNAPSHOT_DIR, SNAPSHOT_LOCK_FILE), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        snapshot = map_shared_snapshot()
+        if snapshot is not None and (version is None or snapshot.version is None or snapshot.version >= version):
+            return snapshot
+
+        publish_shared_snapshot(load_catalog_snapshot())
+        return map_shared_snapshot()
+
+
+def reload_catalog_snapshot(version=None):
+    global _catalog_snapshot, _snapshot_loading
+
+    try:
+        if CATALOG_SNAPSHOT_DIR:
+            _catalog_snapshot = load_shared_snapshot(version)
+        else:
+            _catalog_snapshot = load_catalog_snapshot()
+    except (psycopg2.Error, OSError, ValueError) as e:
+        logger.error(f"No se ha podido cargar el snapshot del catálogo: {e}")
+    finally:
+        _snapshot_loading = False
+
+
+def get_catalog_snapshot():
+    """
+    Returns the in-memory catalog snapshot of this worker (utils/catalog_snapshot.py).
+    With CATALOG_SNAPSHOT_DIR every worker maps the same files instead of holding its own copy.
+    The first call loads it. When the catalog version changes it is reloaded in a background thread
+    and, meanwhile, None is returned so the endpoints answer from PostgreSQL instead of serving old data
+    under the new version (ETags, cache keys).
+
+    :return: CatalogSnapshot or None
+    """
+    global _snapshot_loading
+
+    if not CATALOG_SNAPSHOT_ENABLED:
+        return None
+
+    version = get_catalog_version()
+    snapshot = _catalog_snapshot
+    if snapshot is not None and (version is None or snapshot.version is None or snapshot.version >= version):
+        return snapshot
+
+    with _snapshot_lock:
+        if _snapshot_loading:
+            return None
+        _snapshot_loading = True
+
+    if snapshot is None:
+        reload_catalog_snapshot(version)
+        return _catalog_snapshot
+
+    threading.Thread(target=reload_catalog_snapshot, args=(version,), daemon=True).start()
+    return None
+
+
+def get_category_facets(category, where_str, params):
+    """
+    Returns the numeric facets of a category (database/product_numeric_specs.sql) computed over the
+    catalog_products rows selected by the WHERE clause: range and histogram of the values.
+
+    :param category: category name
+    :param where_str: WHERE clause selecting the listing
+    :param params: parameters of the WHERE clause
+    :return: dict {facet: {"min", "max", "histogram": [{"value", "products"}]}}
+    """
+    query = f"""
+        SELECT f.facet, n.value, COUNT(n.product_id) as products
+        FROM numeric_spec_facets f
+        LEFT JOIN (
+            SELECT n.facet, n.value, n.product_id
+            FROM product_numeric_specs n
+            JOIN catalog_products cp ON cp.product_id = n.product_id
+            {where_str}
+        ) n ON n.facet = f.facet
+        WHERE f.category = %s
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+        """
+
+    with sql_connection(readonly=True) as connection:
+        with connection.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+            cursor.execute(query, tuple(params) + (category,))
+            rows = cursor.fetchall()
+
+    facets = {}
+    for row in rows:
+        facet = facets.setdefault(row["facet"], {"min": None, "max": None, "histogram": []})
+        if row["value"] is None:
+            continue
+
+        # Rows are ordered by value
+        if facet["min"] is None:
+            facet["min"] = row["value"]
+        facet["max"] = row["value"]
+        facet["histogram"].append({"value": row["value"], "products": row["products"]})
+
+    return facets
+
+
+def get_catalog_page(product_str, where_str, params, price_column, limit, after=None, descending=False, nullable=True):
+    """
+    Returns one page of catalog_products using keyset pagination on (price, uuid).
+    Only limit + 1 rows are read, through the (category, price, uuid) indexes. Products without price go last:
+    they are only read, ordered by uuid, once the priced products run out, so both keysets stay index conditions.
+
+    :param product_str: SQL expression building the JSON of a product
+    :param where_str: WHERE clause selecting the listing
+    :param params: parameters of the WHERE clause
+    :param price_column: price column the listing is ordered by
+    :param limit: page size
+    :param after: (price or None, uuid) of the last product of the previous page
+    :param descending: order by price (and uuid) descending
+    :param nullable: the listing can have products without price (False when where_str requires a price)
+    :return: tuple (list of products, cursor of the next page or None)
+    """
+    params = tuple(params)
+    operator = "<" if descending else ">"
+    order_str = "DESC" if descending else "ASC"
+
+    def select_str(condition_str, order_by_str):
+        return f"""
+            SELECT {price_column} as cursor_price, cp.uuid as cursor_uuid, {product_str} as product
+            FROM catalog_products cp
+            {where_str} {condition_str}
+            ORDER BY {order_by_str}
+            LIMIT %s
+            """
+
+    rows = []
+    with sql_connection(readonly=True) as connection:
+        with connection.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+            if not after or after[0] is not None:
+                priced_str = f"AND {price_column} IS NOT NULL"
+                priced_params = params
+                if after:
+                    priced_str += f" AND ({price_column}, cp.uuid) {operator} (%s::numeric, %s)"
+                    priced_params += after
+
+                cursor.execute(select_str(priced_str, f"{price_column} {order_str} NULLS LAST, cp.uuid {order_str}"), priced_params + (limit + 1,))
+                rows = cursor.fetchall()
+
+            if nullable and len(rows) <= limit:
+                unpriced_str = f"AND {price_column} IS NULL"
+                unpriced_params = params
+                if after and after[0] is None:
+                    unpriced_str += f" AND cp.uuid {operator} %s"
+                    unpriced_params += (after[1],)
+
+                cursor.execute(select_str(unpriced_str, f"cp.uuid {order_str}"), unpriced_params + (limit + 1 - len(rows),))
+                rows += cursor.fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]["cursor_price"], rows[-1]["cursor_uuid"])
+
+    return [row["product"] for row in rows], next_cursor
+
+
+def trigram_search_available():
+    """
+    Returns whether pg_trgm is installed (database/product_search.sql), checked once per catalog version.
+
+    :return: bool
+    """
+    global _trigram_search, _trigram_search_version
+
+    version = get_catalog_version()
+    if _trigram_search is not None and version is not None and version == _trigram_search_version:
+        return _trigram_search
+
+    with sql_connection(readonly=True) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")
+            _trigram_search = cursor.fetchone()[0]
+
+    if not _trigram_search:
+        logger.warning("pg_trgm no está instalado, la búsqueda usa el índice en memoria")
+    _trigram_search_version = version
+    return _trigram_search
+
+
+def build_ngram_index():
+    """
+    Builds the n-gram index of the searchable products from the catalog snapshot or, when the snapshot
+    is disabled, from catalog_products.
+
+    :return: NgramIndex or None if the snapshot of the current version is still loading
+    """
+    if CATALOG_SNAPSHOT_ENABLED:
+        snapshot = get_catalog_snapshot()
+        if snapshot is None:
+            return None
+        version, products = snapshot.version, snapshot.search_products()
+    else:
+        version = get_catalog_version()
+        with sql_connection(readonly=True) as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT {SEARCH_PRODUCT_STR} FROM catalog_products cp {SEARCH_WHERE_STR} ORDER BY cp.uuid")
+                products = [row[0] for row in cursor.fetchall()]
+
+    start = time.monotonic()
+    index = NgramIndex(products, version=version)
+    logger.info(f"Índice de búsqueda del catálogo {version}: {len(index)} productos en {time.monotonic() - start:.2f}s")
+    return index
+
+
+def ngram_indexer():
+    """
+    Rebuilds the n-gram index when the catalog version changes and swaps it in, so the searches
+    never build it. Without changes (or with pg_trgm installed) it only checks the version every
+    CATALOG_VERSION_CHECK_INTERVAL seconds.
+    """
+    global _ngram_index
+
+    while True:
+        try:
+            version = get_catalog_version()
+            index = _ngram_index
+            if not trigram_search_available() and (index is None or version is None or index.version != version):
+                _ngram_index = build_ngram_index() or index
+        except Exception as e:
+            logger.error(f"No se ha podido construir el índice de búsqueda: {e}")
+
+        time.sleep(CATALOG_VERSION_CHECK_INTERVAL)
+
+
+def start_ngram_indexer():
+    """
+    Starts the thread that keeps the in-process n-gram index of the worker up to date.
+    """
+    global _ngram_indexer_started
+
+    with _refresh_lock:
+        if _ngram_indexer_started:
+            return
+        _ngram_indexer_started = True
+
+    threading.Thread(target=ngram_indexer, daemon=True).start()
+
+
+def get_ngram_index():
+    """
+    Returns the in-process n-gram index of the product names, built in the background (ngram_indexer).
+
+    :return: NgramIndex or None until the first one is built
+    """
+    return _ngram_index
+
+
+def search_products(text, limit, category=None):
+    """
+    Returns the products whose name matches the text, best match first. It uses the pg_trgm
+    index of catalog_products.name or, without the extension, the in-process n-gram index.
+
+    :param text: text to search
+    :param limit: max number of products
+    :param category: only products of this category
+    :return: list of products
+    """
+    category_str = ""
+    if category:
+        category_str = "AND cp.category = %s"
+
+    if not trigram_search_available():
+        index = get_ngram_index()
+        if index is not None:
+            return index.search(text, limit, category)
+
+        # Until the first index is built, names containing every word of the text
+        words = [word.replace("_", r"\_") for word in WORD_REGEX.findall(text)]
+        if not words:
+            return []
+        words_str = " AND ".join(["cp.name ILIKE %s"] * len(words))
+        query = f"""
+            SELECT {SEARCH_PRODUCT_STR} as product
+            FROM catalog_products cp
+            {SEARCH_WHERE_STR} AND {words_str} {category_str}
+            ORDER BY length(cp.name), cp.uuid
+            LIMIT %s
+            """
+        params = tuple(f"%{word}%" for word in words) + ((category,) if category else ()) + (limit,)
+        with sql_connection(readonly=True) as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(query, params)
+                return [row[0] for row in cursor.fetchall()]
+
+    params = (text,)
+    if category:
+        params += (category,)
+
+    # <% (word similarity) is answered by the trigram GIN index
+    query = f"""
+        SELECT {SEARCH_PRODUCT_STR} as product
+        FROM catalog_products cp
+        {SEARCH_WHERE_STR} AND %s <%% cp.name {category_str}
+        ORDER BY word_similarity(%s, cp.name) DESC, length(cp.name), cp.uuid
+        LIMIT %s
+        """
+
+    with sql_connection(readonly=True) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute(query, params + (text, limit))
+            return [row[0] for row in cursor.fetchall()]
@@ -0,0 +1,78 @@
+-- Numeric attributes of the products (GPU memory, chassis clearances, cooler height, RAM frequency)
+-- extracted once from product_specs_documents into typed, indexed rows. /api/category and /api/facets
+-- compute their ranges and histograms from here instead of parsing the specs JSON on every request.
+-- Must be applied after database/product_specs_documents.sql
+
+-- Facets of every category: spec name of the document and name of the facet in the API
+CREATE TABLE IF NOT EXISTS numeric_spec_facets (
+    category TEXT NOT NULL,
+    facet TEXT NOT NULL,
+    spec_name TEXT NOT NULL,
+    PRIMARY KEY (category, facet)
+);
+
+INSERT INTO numeric_spec_facets (category, facet, spec_name) VALUES
+    ('GPU', 'memory', 'Tamaño Memoria'),
+    ('Chassis', 'cpu', 'Altura máxima CPU'),
+    ('Chassis', 'gpu', 'Longitud máxima GPU'),
+    ('CPU Cooler', 'cpu', 'Altura (ventilador incluido)'),
+    ('RAM', 'freq', 'Frecuencia Memoria')
+ON CONFLICT (category, facet) DO UPDATE SET spec_name = EXCLUDED.spec_name;
+
+
+CREATE TABLE IF NOT EXISTS product_numeric_specs (
+    product_id INTEGER NOT NULL REFERENCES product_specs_documents(product_id) ON DELETE CASCADE,
+    facet TEXT NOT NULL,
+    value INTEGER NOT NULL,
+    PRIMARY KEY (product_id, facet)
+);
+
+CREATE INDEX IF NOT EXISTS product_numeric_specs_facet_value ON product_numeric_specs (facet, value, product_id);
+
+
+CREATE OR REPLACE FUNCTION refresh_product_numeric_specs(product_ids INTEGER[]) RETURNS VOID AS $$
+BEGIN
+    DELETE FROM product_numeric_specs WHERE product_id = ANY(product_ids);
+
+    -- First number of the spec value ("8 GB" -> 8, "3200 MHz" -> 3200)
+    INSERT INTO product_numeric_specs (product_id, facet, value)
+    SELECT product_id, facet, number::int
+    FROM (
+        SELECT psd.product_id, f.facet, substring(psd.specs->>f.spec_name, '\d{1,9}') AS number
+        FROM product_specs_documents psd
+        JOIN products p ON p._id = psd.product_id
+        JOIN categories c ON c._id = p.category_id
+        JOIN numeric_spec_facets f ON f.category = c.name
+        WHERE psd.product_id = ANY(product_ids)
+    ) extracted
+    WHERE number IS NOT NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION product_numeric_specs_changed() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'products' THEN
+        PERFORM refresh_product_numeric_specs(ARRAY[NEW._id]);
+    ELSE
+        PERFORM refresh_product_numeric_specs(ARRAY[NEW.product_id]);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Deleted documents are removed by the foreign key
+DROP TRIGGER IF EXISTS product_numeric_specs_psd ON product_specs_documents;
+CREATE TRIGGER product_numeric_specs_psd AFTER INSERT ON product_specs_documents
+    FOR EACH ROW EXECUTE FUNCTION product_numeric_specs_changed();
+DROP TRIGGER IF EXISTS product_numeric_specs_psd_update ON product_specs_documents;
+CREATE TRIGGER product_numeric_specs_psd_update AFTER UPDATE ON product_specs_documents
+    FOR EACH ROW WHEN (OLD.specs IS DISTINCT FROM NEW.specs) EXECUTE FUNCTION product_numeric_specs_changed();
+
+-- The facets depend on the category of the product
+DROP TRIGGER IF EXISTS product_numeric_specs_products ON products;
+CREATE TRIGGER product_numeric_specs_products AFTER UPDATE OF category_id ON products
+    FOR EACH ROW WHEN (OLD.category_id IS DISTINCT FROM NEW.category_id) EXECUTE FUNCTION product_numeric_specs_changed();
+
+
+SELECT refresh_product_numeric_specs(ARRAY(SELECT product_id FROM product_specs_documents));
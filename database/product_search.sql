@@ -0,0 +1,8 @@
+-- Trigram index of the product names served by /api/search
+-- Without pg_trgm the endpoint falls back to an in-process n-gram index (utils/ngram_index.py)
+-- Must be applied after database/catalog_products.sql
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Supports the word similarity operator (query <% name)
+CREATE INDEX IF NOT EXISTS catalog_products_name_trgm_idx ON catalog_products USING gin (name gin_trgm_ops);
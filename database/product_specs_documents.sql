@@ -0,0 +1,78 @@
+-- Specs document of every product: {spec name: value} as built by json_object_agg(sp.name, ps.value)
+-- /api/product, catalog_products (/api/category, /api/categories) read it instead of regrouping
+-- product_specs on every request. Triggers keep it up to date when specs change.
+-- Must be applied before database/catalog_products.sql
+
+CREATE TABLE IF NOT EXISTS product_specs_documents (
+    product_id INTEGER PRIMARY KEY REFERENCES products(_id) ON DELETE CASCADE,
+    specs JSONB NOT NULL
+);
+
+
+CREATE OR REPLACE FUNCTION refresh_product_specs_documents(product_ids INTEGER[]) RETURNS VOID AS $$
+BEGIN
+    INSERT INTO product_specs_documents (product_id, specs)
+    SELECT ps.product_id, jsonb_object_agg(sp.name, ps.value)
+    FROM product_specs ps
+    LEFT JOIN specs sp ON ps.spec_id = sp._id
+    WHERE ps.product_id = ANY(product_ids) AND ps.value != 'None'
+    GROUP BY ps.product_id
+    ON CONFLICT (product_id) DO UPDATE SET specs = EXCLUDED.specs;
+
+    -- Products left without specs
+    DELETE FROM product_specs_documents psd
+    WHERE psd.product_id = ANY(product_ids)
+    AND NOT EXISTS (SELECT 1 FROM product_specs ps WHERE ps.product_id = psd.product_id AND ps.value != 'None');
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Statement level: every statement refreshes the distinct products it touched once, whatever the number of rows
+CREATE OR REPLACE FUNCTION product_specs_documents_ps_changed() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_product_specs_documents(ARRAY(SELECT DISTINCT product_id FROM new_rows));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM refresh_product_specs_documents(ARRAY(SELECT DISTINCT product_id FROM old_rows));
+    ELSE
+        -- Only the rows that actually changed
+        PERFORM refresh_product_specs_documents(ARRAY(
+            SELECT product_id FROM (SELECT * FROM new_rows EXCEPT SELECT * FROM old_rows) changed
+            UNION
+            SELECT product_id FROM (SELECT * FROM old_rows EXCEPT SELECT * FROM new_rows) changed
+        ));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION product_specs_document_spec_renamed() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM refresh_product_specs_documents(ARRAY(SELECT DISTINCT product_id FROM product_specs WHERE spec_id = NEW._id));
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP FUNCTION IF EXISTS product_specs_document_changed() CASCADE;
+
+-- Transition tables need one trigger per event
+DROP TRIGGER IF EXISTS product_specs_documents_ps ON product_specs;
+DROP TRIGGER IF EXISTS product_specs_documents_ps_insert ON product_specs;
+CREATE TRIGGER product_specs_documents_ps_insert AFTER INSERT ON product_specs
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION product_specs_documents_ps_changed();
+DROP TRIGGER IF EXISTS product_specs_documents_ps_delete ON product_specs;
+CREATE TRIGGER product_specs_documents_ps_delete AFTER DELETE ON product_specs
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION product_specs_documents_ps_changed();
+DROP TRIGGER IF EXISTS product_specs_documents_ps_update ON product_specs;
+CREATE TRIGGER product_specs_documents_ps_update AFTER UPDATE ON product_specs
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION product_specs_documents_ps_changed();
+
+-- Renaming a spec changes the key of every document using it
+DROP TRIGGER IF EXISTS product_specs_documents_sp ON specs;
+CREATE TRIGGER product_specs_documents_sp AFTER UPDATE OF name ON specs
+    FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name) EXECUTE FUNCTION product_specs_document_spec_renamed();
+
+SELECT refresh_product_specs_documents(ARRAY(SELECT _id FROM products));
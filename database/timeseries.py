@@ -0,0 +1,300 @@
+import abc
+import datetime
+import logging
+import os
+import sqlite3
+from contextlib import closing
+
+from utils.price_history import price_history_rows, price_history_rows_by_uuid
+
+try:
+    from influxdb_client import InfluxDBClient
+except ImportError:
+    InfluxDBClient = None
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.propagate = True
+
+HOSTNAME = os.environ.get("HOSTNAME", False)
+INFLUXDB_LOCAL_URL = os.environ.get("INFLUXDB_LOCAL_URL")
+INFLUXDB_REMOTE_URL = os.environ.get("INFLUXDB_REMOTE_URL")
+INFLUXDB_TOKEN = os.environ.get("INFLUXDB_TOKEN")
+INFLUXDB_BUCKET = os.environ.get("INFLUXDB_BUCKET")
+INFLUXDB_ORG = os.environ.get("INFLUXDB_ORG")
+
+## Price time series store: "influx" or "sqlite" (embedded, TIMESERIES_SQLITE_PATH)
+TIMESERIES_BACKEND = os.environ.get("TIMESERIES_BACKEND", "influx")
+TIMESERIES_SQLITE_PATH = os.environ.get("TIMESERIES_SQLITE_PATH", "prices.sqlite3")
+
+## Ordinal of the UTC day 0 of the unix timestamps
+UNIX_EPOCH_DAY = datetime.date(1970, 1, 1).toordinal()
+
+
+def get_influx_url():
+    """
+    Returns the influxDB URL depending of the hostname/environment.
+
+    :return: string of influxDB URL
+    """
+
+    if HOSTNAME == "Docker":
+        # Localhost / Docker
+        return INFLUXDB_LOCAL_URL
+    else:
+        # Remote Host
+        return INFLUXDB_REMOTE_URL
+
+
+def flux_string(value):
+    """
+    Returns the Flux string literal of the value.
+    """
+    escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("${", "\\${")
+    return f'"{escaped}"'
+
+
+class TimeSeriesBackend(abc.ABC):
+    """
+    Store of the prices of the products (uuid, shop, time, price) read by the product and opportunity pages.
+    """
+
+    @abc.abstractmethod
+    def daily_min_by_shop(self, uuid, start):
+        """
+        Returns the daily min price of every shop of the product since the start, ordered by day.
+
+        :param uuid: product uuid
+        :param start: first instant (aware datetime, UTC midnight)
+        :return: iterable of (day ordinal, {shop: price})
+        """
+
+    @abc.abstractmethod
+    def daily_min_by_shop_many(self, uuids, start):
+        """
+        Returns the daily min price of every shop of several products since the start, in one query.
+
+        :param uuids: list of product uuids
+        :param start: first instant (aware datetime, UTC midnight)
+        :return: dictionary {uuid: [(day ordinal, {shop: price})]}, products without prices are missing
+        """
+
+    @abc.abstractmethod
+    def min_by_uuid(self, start, stop):
+        """
+        Returns the min price of every product between start and stop.
+
+        :param start: first instant (aware datetime)
+        :param stop: end instant, excluded (aware datetime)
+        :return: dictionary {uuid: price}
+        """
+
+    @abc.abstractmethod
+    def current_min_by_uuid(self, start):
+        """
+        Returns the min price of every product since the start and the shop having it.
+
+        :param start: first instant (aware datetime)
+        :return: dictionary {uuid: (shop, price)}
+        """
+
+
+class InfluxTimeSeries(TimeSeriesBackend):
+    """
+    Prices in the "prices" measurement of an InfluxDB bucket (tags uuid and shop, field price).
+    Queries are parametrized Flux read as a stream of records.
+    """
+
+    ## Daily min price of every shop, one row per day (window start) and one column per shop
+    DAILY_MIN_BY_SHOP_QUERY = """
+        from(bucket: _bucket)
+        |> range(start: _start, stop: now())
+        |> filter(fn: (r) => r["_measurement"] == "prices" and r["uuid"] == _uuid)
+        |> group(columns: ["shop"])
+        |> aggregateWindow(every: 1d, fn: min, createEmpty: false, timeSrc: "_start")
+        |> keep(columns: ["_time", "shop", "_value"])
+        |> group()
+        |> pivot(rowKey: ["_time"], columnKey: ["shop"], valueColumn: "_value")
+        |> sort(columns: ["_time"])
+        |> yield(name: "prices")
+        """
+
+    ## Same as DAILY_MIN_BY_SHOP_QUERY for every uuid of the {uuids_filter} predicate, one table per uuid
+    DAILY_MIN_BY_SHOP_MANY_QUERY = """
+        from(bucket: _bucket)
+        |> range(start: _start, stop: now())
+        |> filter(fn: (r) => r["_measurement"] == "prices" and ({uuids_filter}))
+        |> group(columns: ["uuid", "shop"])
+        |> aggregateWindow(every: 1d, fn: min, createEmpty: false, timeSrc: "_start")
+        |> keep(columns: ["_time", "uuid", "shop", "_value"])
+        |> group(columns: ["uuid"])
+        |> pivot(rowKey: ["_time"], columnKey: ["shop"], valueColumn: "_value")
+        |> sort(columns: ["_time"])
+        |> yield(name: "prices")
+        """
+
+    ## Min price of every product, the record keeps the shop of the min
+    MIN_BY_UUID_QUERY = """
+        from(bucket: _bucket)
+        |> range(start: _start, stop: _stop)
+        |> filter(fn: (r) => r["_measurement"] == "prices" and r["_field"] == "price")
+        |> group(columns: ["uuid"])
+        |> min(column: "_value")
+        |> keep(columns: ["uuid", "shop", "_value"])
+        |> yield(name: "min_price")
+        """
+
+    def __init__(self, url, token, org, bucket):
+        if InfluxDBClient is None:
+            raise RuntimeError("influxdb-client no está instalado")
+
+        # The client does not connect until the first query
+        self.client = InfluxDBClient(url=url, token=token, org=org)
+        self.query_api = self.client.query_api()
+        self.bucket = bucket
+
+    def query(self, query, **params):
+        return self.query_api.query_stream(query=query, params={"_bucket": self.bucket, **params})
+
+    def daily_min_by_shop(self, uuid, start):
+        # Records are parsed while the response is read
+        return price_history_rows(self.query(self.DAILY_MIN_BY_SHOP_QUERY, _start=start, _uuid=str(uuid)))
+
+    def daily_min_by_shop_many(self, uuids, start):
+        if not uuids:
+            return {}
+
+        # An equality chain is pushed down to the storage (contains() reads every series and filters afterwards)
+        uuids_filter = " or ".join(f'r["uuid"] == {flux_string(uuid)}' for uuid in uuids)
+        query = self.DAILY_MIN_BY_SHOP_MANY_QUERY.replace("{uuids_filter}", uuids_filter)
+        return price_history_rows_by_uuid(self.query(query, _start=start))
+
+    def min_by_uuid(self, start, stop):
+        return {record.values["uuid"]: float(record.get_value()) for record in self.query(self.MIN_BY_UUID_QUERY, _start=start, _stop=stop)}
+
+    def current_min_by_uuid(self, start):
+        stop = datetime.datetime.now(datetime.timezone.utc)
+        records = self.query(self.MIN_BY_UUID_QUERY, _start=start, _stop=stop)
+        return {record.values["uuid"]: (record.values["shop"], float(record.get_value())) for record in records}
+
+
+class SQLiteTimeSeries(TimeSeriesBackend):
+    """
+    Prices in an embedded SQLite file, table prices(uuid, shop, time, price) with the time in unix seconds.
+    Only the benchmarks write it (write()), it is meant for offline benchmarks and tests of the read paths.
+    Every query opens its own connection, so it can be used from any thread.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS prices (
+            uuid TEXT NOT NULL,
+            shop TEXT NOT NULL,
+            time INTEGER NOT NULL,
+            price REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS prices_uuid_time_idx ON prices (uuid, time);
+        CREATE INDEX IF NOT EXISTS prices_time_idx ON prices (time);
+        """
+
+    def __init__(self, path):
+        self.path = path
+        with closing(self.connect()) as connection:
+            connection.executescript(self.SCHEMA)
+
+    def connect(self):
+        return sqlite3.connect(self.path)
+
+    def is_empty(self):
+        with closing(self.connect()) as connection:
+            return connection.execute("SELECT NOT EXISTS (SELECT 1 FROM prices)").fetchone()[0] == 1
+
+    def write(self, prices):
+        """
+        Adds prices to the store.
+
+        :param prices: iterable of (uuid, shop, aware datetime, price)
+        """
+        rows = ((str(uuid), shop, int(time.timestamp()), price) for uuid, shop, time, price in prices)
+        with closing(self.connect()) as connection:
+            with connection:
+                connection.executemany("INSERT INTO prices (uuid, shop, time, price) VALUES (?, ?, ?, ?)", rows)
+
+    def daily_min_by_shop(self, uuid, start):
+        query = """
+            SELECT time / 86400 AS day, shop, MIN(price)
+            FROM prices
+            WHERE uuid = ? AND time >= ?
+            GROUP BY day, shop
+            ORDER BY day
+            """
+        with closing(self.connect()) as connection:
+            rows = connection.execute(query, (str(uuid), int(start.timestamp()))).fetchall()
+
+        day_prices = {}
+        for day, shop, price in rows:
+            day_prices.setdefault(UNIX_EPOCH_DAY + day, {})[shop] = price
+        return list(day_prices.items())
+
+    def daily_min_by_shop_many(self, uuids, start):
+        if not uuids:
+            return {}
+
+        uuids = [str(uuid) for uuid in uuids]
+        query = f"""
+            SELECT uuid, time / 86400 AS day, shop, MIN(price)
+            FROM prices
+            WHERE uuid IN ({", ".join("?" * len(uuids))}) AND time >= ?
+            GROUP BY uuid, day, shop
+            ORDER BY uuid, day
+            """
+        with closing(self.connect()) as connection:
+            rows = connection.execute(query, (*uuids, int(start.timestamp()))).fetchall()
+
+        day_prices = {}
+        for uuid, day, shop, price in rows:
+            day_prices.setdefault(uuid, {}).setdefault(UNIX_EPOCH_DAY + day, {})[shop] = price
+        return {uuid: list(days.items()) for uuid, days in day_prices.items()}
+
+    def min_by_uuid(self, start, stop):
+        query = "SELECT uuid, MIN(price) FROM prices WHERE time >= ? AND time < ? GROUP BY uuid"
+        with closing(self.connect()) as connection:
+            return dict(connection.execute(query, (int(start.timestamp()), int(stop.timestamp()))).fetchall())
+
+    def current_min_by_uuid(self, start):
+        # SQLite takes the bare column (shop) from the row of the MIN()
+        query = "SELECT uuid, shop, MIN(price) FROM prices WHERE time >= ? GROUP BY uuid"
+        with closing(self.connect()) as connection:
+            rows = connection.execute(query, (int(start.timestamp()),)).fetchall()
+        return {uuid: (shop, price) for uuid, shop, price in rows}
+
+
+def create_timeseries_backend(name):
+    """
+    Returns the time series backend of the name (TIMESERIES_BACKEND).
+    """
+    if name == "sqlite":
+        # Nothing in the repository writes the SQLite store but the benchmarks (offline use only)
+        backend = SQLiteTimeSeries(TIMESERIES_SQLITE_PATH)
+        if backend.is_empty():
+            logger.warning(f"El almacén SQLite {TIMESERIES_SQLITE_PATH} está vacío: no habrá históricos de precios ni oportunidades")
+        return backend
+    if name == "influx":
+        return InfluxTimeSeries(get_influx_url(), INFLUXDB_TOKEN, INFLUXDB_ORG, INFLUXDB_BUCKET)
+
+    raise ValueError(f"Backend de series temporales desconocido: {name}")
+
+
+_timeseries = None
+
+
+def get_timeseries():
+    """
+    Returns the time series backend of the worker, created on first use so importing the routes
+    needs neither the backend nor its package.
+
+    :return: TimeSeriesBackend
+    """
+    global _timeseries
+    if _timeseries is None:
+        _timeseries = create_timeseries_backend(TIMESERIES_BACKEND)
+    return _timeseries
@@ -0,0 +1,18 @@
+workers = 4
+bind = "0.0.0.0:6000"
+
+
+def post_worker_init(worker):
+    """
+    Warms the caches of the worker up before it accepts connections, so a worker sharing the port
+    never answers from cold caches. The heartbeat is kept while waiting so the arbiter does not
+    kill the worker for a long warm-up.
+
+    :param worker: gunicorn worker, the application is already loaded (worker.wsgi)
+    """
+    # Imported here: the arbiter must not open database connections before forking
+    from utils.warmup import start_warmup
+
+    ready = start_warmup(worker.wsgi)
+    while not ready.wait(1):
+        worker.notify()
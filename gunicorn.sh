@@ -1,2 +1,2 @@
 #!/bin/bash
-gunicorn --workers 4 --bind 0.0.0.0:6000 server:app
\ No newline at end of file
+gunicorn -c gunicorn.conf.py server:app
\ No newline at end of file
@@ -1,12 +1,22 @@
+import json
 import logging
 import math
-import re
+import os
+from http import HTTPStatus
 
 import psycopg2
 import psycopg2.extras
+import utils.error_messages as errors
 import utils.valid_messages as valid_messages
 from database.db_connection import sql_connection
-from flask import Blueprint
+from database.db_management.catalog_management import GPU_MODEL_SPEC_ID, get_catalog_page, get_catalog_snapshot, get_category_facets, get_gpu_taxonomy, get_numeric_facets, search_products
+from flask import Blueprint, request
+from utils.catalog_filters import parse_catalog_filters
+from utils.error_messages_management import generate_error_data
+from utils.etag import catalog_etag
+from utils.json_stream import json_stream_response, stream_json_rows, stream_requested
+from utils.pagination import parse_page_args
+from utils.response_cache import cached_response
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -15,6 +25,10 @@ logger.propagate = True
 
 apistock_routing_blueprint = Blueprint("apistock_routing", __name__)
 
+SEARCH_DEFAULT_LIMIT = int(os.environ.get("SEARCH_DEFAULT_LIMIT", 20))
+SEARCH_MAX_LIMIT = int(os.environ.get("SEARCH_MAX_LIMIT", 50))
+SEARCH_MAX_LENGTH = 100
+
 ## Allowed categories
 CATEGORIES = {
     "procesadores": "CPU",
@@ -74,50 +88,88 @@ SPECS_VALUES = {
     "RX7900XTX": "Radeon RX 7900 XTX",
 }
 
+## Products listed by /api/category (and counted by /api/facets)
+CATEGORY_WHERE_STR = "WHERE cp.category = %s AND cp.specs IS NOT NULL AND cp.shops_min_price > 0"
 
-@apistock_routing_blueprint.route("/api/stock/<string:category>", methods=["GET"])
-def get_category_products_in_stock(category):
-    """
-    Returns all the products in stock matching the category.
+## GPU models kept in the deals even if a better model costs about the same
+GPU_DEALS_EXCEPTIONS = ("RTX 3060 Ti", "RX 7900 XTX")
 
-    :param category: type of product
-    :return: dictionary with a list of products
+
+def stock_model_values(model):
     """
-    if not category:
-        return {}
+    Returns the spec values of the model family: RTX models include their LHR variants
+    (and Ti variants unless the model is a Ti), RX models only match their own value.
 
-    category = str(category)
-    result = SPECS_VALUES.get(category, None)
+    :param model: key of SPECS_VALUES
+    :return: tuple of spec values or None
+    """
+    result = SPECS_VALUES.get(model, None)
     if not result:
-        return {}
+        return None
 
     selected = ()
-    if "RTX" in category:
-        is_ti_model = "TI" in category
+    if "RTX" in model:
+        is_ti_model = "TI" in model
         for key, value in SPECS_VALUES.items():
-            if category in key and (is_ti_model or "TI" not in key):
+            if model in key and (is_ti_model or "TI" not in key):
                 if value not in selected:
                     selected += (value,)
-    elif "RX" in category:
+    elif "RX" in model:
         selected = (result,)
     else:
-        return {}
+        return None
+
+    return selected
+
+
+## Spec values of every model family, resolved once
+STOCK_MODEL_VALUES = {model: stock_model_values(model) for model in SPECS_VALUES}
+
 
-    if len(selected) == 1:
-        where_str = f"= '{selected[0]}'"
+def get_models_stock(models):
+    """
+    Returns the products in stock of every model family with a single query.
+
+    :param models: list of SPECS_VALUES keys
+    :return: dict {model: {"min_price", "max_price", "products"}}, models without stock are not included
+    """
+    snapshot = get_catalog_snapshot()
+    if snapshot:
+        stock = snapshot.stock_by_model({model: STOCK_MODEL_VALUES[model] for model in models})
     else:
-        where_str = f"in {selected}"
+        stock = query_models_stock(models)
+
+    for data in stock.values():
+        data["min_price"] = int(math.floor(data["min_price"] / 100.0)) * 100
+        data["max_price"] = int(math.ceil(data["max_price"] / 100.0)) * 100
+    return stock
+
+
+def query_models_stock(models):
+    """
+    Returns the products in stock of every model family reading them from PostgreSQL with a single query.
+
+    :param models: list of SPECS_VALUES keys
+    :return: dict {model: {"min_price", "max_price", "products"}}, models without stock are not included
+    """
+    values, value_models = [], []
+    for model in models:
+        for value in STOCK_MODEL_VALUES[model]:
+            values.append(value)
+            value_models.append(model)
 
     image_str = "'image', COALESCE(images#>>'{medium, 0}',images#>>'{large, 0}')"
 
     query = f"""
             SELECT
-                
+
+            t.model,
             MIN(price) as min_price,
             MAX(price) as max_price,
             json_agg(pr.product_data) as products
             
             FROM product_specs ps
+            JOIN unnest(%s::text[], %s::text[]) AS t(value, model) ON t.value = ps.value
 
             INNER JOIN 
             (
@@ -143,26 +195,77 @@ def get_category_products_in_stock(category):
 
             ) pr ON pr._id = ps.product_id
 
-            WHERE ps.value {where_str}
+            GROUP BY t.model
             """
 
-    with sql_connection() as connection:
+    with sql_connection(readonly=True) as connection:
         with connection.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
-            cursor.execute(query)
-            data = dict(cursor.fetchone())
+            cursor.execute(query, (values, value_models))
+            rows = cursor.fetchall()
+
+    return {row["model"]: {"min_price": row["min_price"], "max_price": row["max_price"], "products": row["products"]} for row in rows}
+
+
+@apistock_routing_blueprint.route("/api/stock", methods=["GET"])
+@catalog_etag
+@cached_response
+def get_models_products_in_stock():
+    """
+    Returns the products in stock of several GPU models at once (?models=RTX3060,RTX3070TI,RX6800).
+
+    :return: dictionary {model: {"min_price", "max_price", "products"}}
+    """
+    models = []
+    for model in request.args.get("models", "").split(","):
+        model = model.strip().upper()
+        if model and model not in models:
+            models.append(model)
+
+    if not models:
+        return generate_error_data(errors.PARAM_NOT_VALID), HTTPStatus.UNAUTHORIZED
+
+    for model in models:
+        if not STOCK_MODEL_VALUES.get(model, None):
+            return generate_error_data(errors.GPU_SPEC_NOT_FOUND), HTTPStatus.UNAUTHORIZED
+
+    stock = get_models_stock(models)
+
+    data = {}
+    for model in models:
+        data[model] = stock.get(model, {"min_price": None, "max_price": None, "products": []})
+
+    valid_messages.petition_completed(f"stock: {','.join(models)}")
+    return data
+
+
+@apistock_routing_blueprint.route("/api/stock/<string:category>", methods=["GET"])
+@catalog_etag
+@cached_response
+def get_category_products_in_stock(category):
+    """
+    Returns all the products in stock matching the category.
+
+    :param category: type of product
+    :return: dictionary with a list of products
+    """
+    if not category:
+        return {}
 
-    if not data.get("products", None):
-        data["products"] = []
-        return data
+    category = str(category)
+    if not STOCK_MODEL_VALUES.get(category, None):
+        return {}
 
-    data["min_price"] = int(math.floor(data["min_price"] / 100.0)) * 100
-    data["max_price"] = int(math.ceil(data["max_price"] / 100.0)) * 100
+    data = get_models_stock([category]).get(category, None)
+    if not data:
+        return {"min_price": None, "max_price": None, "products": []}
 
     valid_messages.petition_completed(f"stock: {category}")
     return data
 
 
 @apistock_routing_blueprint.route("/api/category/<string:category>", methods=["GET"])
+@catalog_etag
+@cached_response
 def get_category_products(category):
     """
     Returns all the products matching the category.
@@ -177,85 +280,57 @@ def get_category_products(category):
     if not category:
         return {}
 
-    image_str = "'image', COALESCE(images#>>'{medium, 0}',images#>>'{large, 0}')"
+    # catalog_products already holds the min price in stock / out of stock of every product (database/catalog_products.sql)
+    product_str = "json_build_object('uuid', cp.uuid, 'name', cp.name, 'refurbished', cp.refurbished, 'image', cp.image, 'specs', cp.specs, 'shops', cp.shops, 'price', cp.price, 'manufacturer', cp.manufacturer, 'stock', cp.stock)"
+    where_str = CATEGORY_WHERE_STR
+
+    try:
+        limit, after = parse_page_args(request.args)
+        filters_str, filters_params, descending = parse_catalog_filters(request.args, get_numeric_facets(category))
+    except ValueError:
+        return generate_error_data(errors.PARAM_NOT_VALID), HTTPStatus.UNAUTHORIZED
+
+    # The summary (price and facet ranges) covers the whole category, the products only the filtered ones
+    products_where_str = where_str + filters_str
+    products_params = (category,) + filters_params
+    order_str = "DESC" if descending else "ASC"
+    order_by_str = f"ORDER BY cp.price {order_str} NULLS LAST, cp.uuid {order_str}"
+
+    streaming = not limit and stream_requested(request.args)
+    products_str = ""
+    summary_params = (category,)
+    if not streaming and not limit:
+        products_str = f", COALESCE(json_agg({product_str} {order_by_str}) FILTER (WHERE TRUE {filters_str}), '[]') as products"
+        summary_params = filters_params + (category,)
+
+    # Keyset pagination: the summary is only sent with the first page
+    if after:
+        products, next_cursor = get_catalog_page(product_str, products_where_str, products_params, "cp.price", limit, after, descending)
+        valid_messages.petition_completed(f"category: {category}")
+        return {"products": products, "next": next_cursor}
+
+    # The whole category in the default order is answered from the in-memory snapshot
+    snapshot = get_catalog_snapshot() if not streaming and not limit and not filters_str and not descending else None
+    products_dict = snapshot.category_listing(category, get_numeric_facets(category)) if snapshot else None
+    if products_dict:
+        products_dict["max_price"] = int(math.ceil(products_dict["max_price"] / 100.0)) * 100
+        products_dict["min_price"] = int(math.floor(products_dict["min_price"] / 100.0)) * 100
+        valid_messages.petition_completed(f"category: {category}")
+        return products_dict
 
-    additional_str = ""
-    if category == "GPU":
-        additional_str = """
-                            MIN(substring(specs->>'Tamaño Memoria', '\d+')::int) as min_memory,
-                            MAX(substring(specs->>'Tamaño Memoria', '\d+')::int) as max_memory,
-                            """
-    elif category == "Chassis":
-        additional_str = """
-                            MIN(substring(specs->>'Altura máxima CPU', '\d+')::int) as min_cpu,
-                            MAX(substring(specs->>'Altura máxima CPU', '\d+')::int) as max_cpu,
-                            MIN(substring(specs->>'Longitud máxima GPU', '\d+')::int) as min_gpu,
-                            MAX(substring(specs->>'Longitud máxima GPU', '\d+')::int) as max_gpu,
-                            """
-
-    elif category == "CPU Cooler":
-        additional_str = """
-                            MIN(substring(specs->>'Altura (ventilador incluido)', '\d+')::int) as min_cpu,
-                            MAX(substring(specs->>'Altura (ventilador incluido)', '\d+')::int) as max_cpu,
-                            """
-    elif category == "RAM":
-        additional_str = """
-                            MIN(substring(specs->>'Frecuencia Memoria', '\d+')::int) as min_freq,
-                            MAX(substring(specs->>'Frecuencia Memoria', '\d+')::int) as max_freq,
-                            """
-
-    query = (
-        """
+    query = f"""
         SELECT 
-
-        MIN(COALESCE(pa.price, pa2.price)) as min_price,
-        MAX(COALESCE(pa.price, pa2.price)) as max_price,
-        """
-        + additional_str
-        + f"""
-        json_agg(json_build_object('uuid', p.uuid, 'name', p.name, 'refurbished', p.refurbished, {image_str}, 'specs', ps.specs, 'shops', pa_sh.shops, 'price', COALESCE(pa.price, pa2.price), 'manufacturer', m.name, 'stock', COALESCE(pa.stock, pa2.stock))) as products
+        MIN(cp.price)::float as min_price,
+        MAX(cp.price)::float as max_price
+        {products_str}
             
-        FROM products p
-        LEFT JOIN categories c on p.category_id = c._id 
-        LEFT JOIN manufacturers m on p.manufacturer_id = m._id
-        JOIN (
-            SELECT product_id, json_object_agg(sp.name,ps.value) AS specs
-            FROM product_specs ps
-            LEFT JOIN specs sp on ps.spec_id = sp._id
-            WHERE ps.value != 'None'
-            GROUP BY 1
-            ) ps on ps.product_id = p._id
-        JOIN (
-            SELECT product_id, json_agg(sh.name) AS shops
-            FROM products_availabilities pa_sh
-            LEFT JOIN shops sh on sh._id = pa_sh.shop_id
-            GROUP BY 1
-            HAVING MIN(pa_sh.price) > 0
-            ) pa_sh on p._id = pa_sh.product_id
-
-        LEFT JOIN (
-            SELECT product_id, MIN(pa.price) AS price, MAX(pa.stock::int) AS stock
-            FROM products_availabilities pa
-			WHERE pa.stock = {True}
-            GROUP BY 1
-            HAVING MIN(pa.price) > 0
-            ) pa ON p._id = pa.product_id
-			
-        LEFT JOIN (
-            SELECT product_id, MIN(pa2.price) AS price, MAX(pa2.stock::int) AS stock
-            FROM products_availabilities pa2
-			WHERE pa2.stock = {False}
-            GROUP BY 1
-            HAVING MIN(pa2.price) > 0
-            ) pa2 ON p._id = pa2.product_id
-
-        WHERE c.name = '{category}' """
-    )
-    # Selecciono el precio mínimo de los productos sin stock (products_dict1) y con stock (products_dict2)
+        FROM catalog_products cp
 
-    with sql_connection() as connection:
+        {where_str} """
+
+    with sql_connection(readonly=True) as connection:
         with connection.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
-            cursor.execute(query)
+            cursor.execute(query, summary_params)
             products_dict = dict(cursor.fetchone())
 
     products_dict["max_price"] = (
@@ -265,116 +340,146 @@ def get_category_products(category):
         int(math.floor(products_dict["min_price"] / 100.0)) * 100
     )
 
+    # Numeric facets are extracted at write time (database/product_numeric_specs.sql)
+    for facet, values in get_category_facets(category, where_str, (category,)).items():
+        products_dict[f"min_{facet}"] = values["min"]
+        products_dict[f"max_{facet}"] = values["max"]
+
+    if limit:
+        products_dict["products"], products_dict["next"] = get_catalog_page(product_str, products_where_str, products_params, "cp.price", limit, descending=descending)
+
     valid_messages.petition_completed(f"category: {category}")
-    return products_dict
+    if not streaming:
+        return products_dict
+
+    # The summary goes first, then the products are written as they are read from the cursor
+    prefix = json.dumps(products_dict)[:-1] + ', "products": ['
+    query = f"SELECT {product_str}::text FROM catalog_products cp {products_where_str} {order_by_str}"
+    return json_stream_response(stream_json_rows(query, products_params, prefix=prefix, suffix="]}"))
+
+
+@apistock_routing_blueprint.route("/api/facets/<string:category>", methods=["GET"])
+@catalog_etag
+@cached_response
+def get_category_facets_ranges(category):
+    """
+    Returns the numeric facets of the category: min/max and histogram of values.
+
+    :param category: type of product
+    :return: dictionary with the facets
+    """
+    if not category:
+        return {}
+
+    category = CATEGORIES.get(str(category), None)
+    if not category:
+        return {}
+
+    where_str = CATEGORY_WHERE_STR
+    facets = get_category_facets(category, where_str, (category,))
+
+    valid_messages.petition_completed(f"facets: {category}")
+    return {"category": category, "facets": facets}
+
+
+@apistock_routing_blueprint.route("/api/search", methods=["GET"])
+@catalog_etag
+@cached_response
+def search():
+    """
+    Returns the products whose name matches the text (?q=), optionally only of a category (?category=).
+
+    :return: dictionary with the list of products, best match first
+    """
+    text = " ".join(request.args.get("q", "").split())
+    if len(text) < 2 or len(text) > SEARCH_MAX_LENGTH:
+        return generate_error_data(errors.PARAM_NOT_VALID), HTTPStatus.UNAUTHORIZED
+
+    category = None
+    if request.args.get("category", None):
+        category = CATEGORIES.get(request.args["category"], None)
+        if not category:
+            return generate_error_data(errors.PARAM_NOT_VALID), HTTPStatus.UNAUTHORIZED
+
+    try:
+        limit = int(request.args.get("limit", SEARCH_DEFAULT_LIMIT))
+    except ValueError:
+        return generate_error_data(errors.PARAM_NOT_VALID), HTTPStatus.UNAUTHORIZED
+    if limit < 1:
+        return generate_error_data(errors.PARAM_NOT_VALID), HTTPStatus.UNAUTHORIZED
+
+    products = search_products(text, min(limit, SEARCH_MAX_LIMIT), category)
+
+    valid_messages.petition_completed(f"search: {text}")
+    return {"products": products}
 
 
 @apistock_routing_blueprint.route("/api/deals", methods=["GET"])
+@catalog_etag
+@cached_response
 def deals():
     """
     Returns the best deals of Graphic Cards (NVIDIA and AMD)
 
     :return: a dict containing the best deals
     """
-    gpu_specs = ()
-    for key in SPECS_VALUES:
-        value = SPECS_VALUES.get(key)
-        if value not in gpu_specs:
-            gpu_specs = (*gpu_specs, value)
+    taxonomy = get_gpu_taxonomy()
+    if not taxonomy:
+        return {"NVIDIA": [], "AMD": []}
 
-    connection = sql_connection()
     image_str = "'image', COALESCE(images#>>'{medium, 0}',images#>>'{large, 0}')"
 
+    # The taxonomy maps each spec value to its model, PostgreSQL keeps the cheapest product of every model
     query = f"""
-            SELECT DISTINCT ON (ps.value)
+            SELECT DISTINCT ON (t.gpu_model)
 
-            ps.value, pa.price,
-            json_agg(json_build_object('uuid', p.uuid, 'name', p.name, {image_str}, 'price', pa.price)) as products
+            t.gpu_model, ps.value, pa.price,
+            json_build_object('uuid', p.uuid, 'name', p.name, {image_str}, 'price', pa.price) as product
                             
             FROM products p
             LEFT JOIN categories c on p.category_id = c._id 
-            LEFT JOIN product_specs ps on ps.product_id = p._id
+            JOIN product_specs ps on ps.product_id = p._id
+            JOIN unnest(%s::text[], %s::text[]) AS t(value, gpu_model) on t.value = ps.value
             JOIN (
                 SELECT product_id, MIN(pa.price) AS price
                 FROM products_availabilities pa
-                LEFT JOIN shops sh on sh._id = pa.shop_id
                 WHERE pa.deleted = {False} AND pa.stock = {True} AND pa.price > 0 AND pa.code > 0
                 GROUP BY 1
                 ) pa on p._id = pa.product_id
 
-            WHERE c.name = 'GPU' AND ps.spec_id = 3
-            GROUP BY ps.value, pa.price
+            WHERE c.name = 'GPU' AND ps.spec_id = {GPU_MODEL_SPEC_ID}
+            ORDER BY t.gpu_model, pa.price, p._id
             """
 
-    cursor = connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute(query)
-    rows = cursor.fetchall()
-    connection.close()
+    snapshot = get_catalog_snapshot()
+    if snapshot:
+        rows = snapshot.cheapest_per_gpu_model(taxonomy)
+    else:
+        with sql_connection(readonly=True) as connection:
+            with connection.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+                cursor.execute(query, taxonomy.arrays())
+                rows = cursor.fetchall()
 
+    # A model is dropped when the next one of the same manufacturer costs less than 10% more,
+    # and a model is skipped when the previous one is better and cheaper
     data = {"NVIDIA": {}, "AMD": {}}
-    models_added = {}
-    nvidia_counter = -1
-    amd_counter = -1
-    saved_row = None
-    gpu_exceptions = {"RTX 3060 Ti": False, "RX 7900 XTX": False}
-    for row in rows:
-        row_data = dict(row)
-        # Base Models (Insensitive to TI or LHR)
-        gpu_model = re.findall(
-            "RTX \d+(?: Ti)?|RX \d+ XT[X]?|RX \d+", row_data["value"], re.IGNORECASE
-        )
-        if not gpu_model:
-            continue
-        gpu_model = gpu_model[0]
-
-        simple_model = re.findall("RTX \d+|RX \d+", gpu_model, re.IGNORECASE)
-        if not simple_model:
-            continue
-        simple_model = simple_model[0]
-
-        manufacturer = "NVIDIA" if simple_model.find("RTX") != -1 else "AMD"
-        gpu_number = int(re.findall("\d\d\d\d", simple_model, flags=re.IGNORECASE)[0])
-
-        result = models_added.get(gpu_model, False)
-        if result and row_data["price"] > result:
-            continue
-
-        if saved_row and gpu_exceptions.get(gpu_model, True):
-            if (
-                saved_row["manufacturer"] == manufacturer
-                and gpu_number >= saved_row["gpu_number"]
-                and row_data["price"] < saved_row["price"] * 1.1
-            ):
-                nvidia_counter = (
-                    nvidia_counter - 1 if manufacturer == "NVIDIA" else nvidia_counter
-                )
-                amd_counter = amd_counter - 1 if manufacturer == "AMD" else amd_counter
-                data[manufacturer].pop(saved_row["gpu_model"])
-            elif (
-                saved_row["manufacturer"] == manufacturer
-                and saved_row["gpu_number"] >= gpu_number
-                and saved_row["price"] < row_data["price"]
-            ):
+    saved_gpu = None
+    saved_price = None
+    for row in sorted(rows, key=lambda row: row["value"]):
+        gpu = taxonomy.lookup(row["value"])
+        price = row["price"]
+
+        if saved_gpu and saved_gpu.manufacturer == gpu.manufacturer and gpu.model not in GPU_DEALS_EXCEPTIONS:
+            if gpu.number >= saved_gpu.number and price < saved_price * 1.1:
+                data[gpu.manufacturer].pop(saved_gpu.model)
+            elif saved_gpu.number >= gpu.number and saved_price < price:
                 continue
 
-        row_data["gpu_model"] = gpu_model
-        row_data["gpu_number"] = gpu_number
-        row_data["manufacturer"] = manufacturer
-        saved_row = row_data
-
-        models_added[gpu_model] = row_data["price"]
-
-        data[manufacturer][gpu_model] = row_data["products"][0]
-        nvidia_counter = (
-            nvidia_counter + 1 if manufacturer == "NVIDIA" else nvidia_counter
-        )
-        amd_counter = amd_counter + 1 if manufacturer == "AMD" else amd_counter
-        continue
+        data[gpu.manufacturer][gpu.model] = row["product"]
+        saved_gpu = gpu
+        saved_price = price
 
-    final_data = {"NVIDIA": [], "AMD": []}
-    for manufacturer in data:
-        for gpu_model in data[manufacturer]:
-            final_data[manufacturer].append(data[manufacturer][gpu_model])
+    final_data = {"NVIDIA": list(data["NVIDIA"].values()), "AMD": list(data["AMD"].values())}
 
     valid_messages.petition_completed("deals")
     return final_data
@@ -6,6 +6,7 @@ import models.auth.auth_data as auth_data
 import models.jwt.JwtToken as Token
 import utils.error_messages as errors
 import utils.valid_messages as valid_messages
+from database.db_connection import primary_engine
 from database.stockfinder_models.base import Session
 from database.stockfinder_models.User import User
 from flask import Blueprint, request
@@ -64,7 +65,7 @@ def login():
     if not check_password_hash(user_validation["user_data"]["pass"], user_data["password"]):
         return generate_error_data(errors.LOGIN_ERROR, user_ip=user_data["user_ip"]), HTTPStatus.UNAUTHORIZED
 
-    session = Session()
+    session = Session(bind=primary_engine())
     user_found = session.query(User).filter(User.email == user_data["email"]).first()
     user_found.last_login_at = datetime.now()
     session.commit()
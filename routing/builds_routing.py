@@ -1,3 +1,4 @@
+import json
 import logging
 import os
 import socket
@@ -10,7 +11,8 @@ import psycopg2
 import psycopg2.extras
 import utils.error_messages as errors
 import utils.valid_messages as valid_messages
-from database.db_connection import sql_connection
+from database.db_connection import primary_engine, sql_connection
+from database.db_management.catalog_management import get_catalog_page, get_catalog_snapshot
 from database.stockfinder_models.Availability import Availability
 from database.stockfinder_models.base import Session
 from database.stockfinder_models.Build import Build
@@ -27,6 +29,10 @@ from database.stockfinder_models.User import User
 from flask import Blueprint, request
 from sqlalchemy import and_
 from utils.error_messages_management import generate_error_data
+from utils.etag import catalog_etag
+from utils.json_stream import json_stream_response, stream_json_rows, stream_requested
+from utils.pagination import parse_page_args
+from utils.response_cache import cached_response
 from utils.validate_inputs import valid_data_recv
 
 logger = logging.getLogger(__name__)
@@ -207,7 +213,7 @@ def build_add():
 
     logger.warning(build_dict)
 
-    session = Session()
+    session = Session(bind=primary_engine())
     new_build = Build(**build_dict)
     session.add(new_build)
     session.commit()
@@ -220,6 +226,8 @@ def build_add():
 
 
 @build_routing_blueprint.route("categories/<string:category>", methods=["GET"])
+@catalog_etag
+@cached_response
 def get_product_from_category(category):
     """
     Returns a list of products matching that category. It comes with the Product format.
@@ -229,56 +237,53 @@ def get_product_from_category(category):
     """
     if not category or not category in CATEGORIES:
         return {"products": []}
-    image_str = "'image', COALESCE(images#>>'{medium, 0}',images#>>'{large, 0}')"
+
+    product_str = """json_build_object(
+            'uuid', cp.uuid, 
+            'name', cp.name, 
+            'refurbished', cp.refurbished, 
+            'specifications', cp.specs, 
+            'availabilities', cp.availabilities, 
+            'manufacturer', cp.manufacturer,
+            'image', cp.image
+            )"""
+    where_str = "WHERE cp.category = %s AND cp.deleted = FALSE AND cp.specs IS NOT NULL AND cp.availabilities_min_price > 0"
+
+    try:
+        limit, after = parse_page_args(request.args)
+    except ValueError:
+        return generate_error_data(errors.PARAM_NOT_VALID), HTTPStatus.UNAUTHORIZED
+
+    if limit:
+        products, next_cursor = get_catalog_page(product_str, where_str, (CATEGORIES[category],), "cp.availabilities_min_price", limit, after, nullable=False)
+        valid_messages.petition_completed(f"get_product_from_category: {category}")
+        return {"category": category, "products": products, "next": next_cursor}
+
+    if stream_requested(request.args):
+        query = f"SELECT {product_str}::text FROM catalog_products cp {where_str} ORDER BY cp.availabilities_min_price"
+        prefix = json.dumps({"category": category})[:-1] + ', "products": ['
+
+        valid_messages.petition_completed(f"get_product_from_category: {category}")
+        return json_stream_response(stream_json_rows(query, (CATEGORIES[category],), prefix=prefix, suffix="]}"))
+
+    snapshot = get_catalog_snapshot()
+    if snapshot:
+        valid_messages.petition_completed(f"get_product_from_category: {category}")
+        return {"category": category, "products": snapshot.build_listing(CATEGORIES[category])}
 
     query = f"""
         SELECT 
-        json_agg(json_build_object(
-            'uuid', p.uuid, 
-            'name', p.name, 
-            'refurbished', p.refurbished, 
-            'specifications', ps.specs, 
-            'availabilities', pa.availabilities, 
-            'manufacturer', m.name,
-            {image_str}
-            ) ORDER BY pa.min_price
-        ) as products
-            
-        FROM products p
-        LEFT JOIN categories c on p.category_id = c._id 
-        LEFT JOIN manufacturers m on p.manufacturer_id = m._id
-        JOIN (
-            SELECT product_id, json_object_agg(sp.name,ps.value) AS specs
-            FROM product_specs ps
-            LEFT JOIN specs sp on ps.spec_id = sp._id
-            WHERE ps.value != 'None'
-            GROUP BY 1
-            ) ps on ps.product_id = p._id
-        JOIN (
-            SELECT 
-            product_id, 
-            MIN(pa.price) AS min_price,
-            json_agg(
-                json_build_object('shopName', sh.name, 'url', pa.url, 'price', pa.price) ORDER BY pa.price
-            ) AS availabilities
-
-            FROM products_availabilities pa
-            LEFT JOIN shops sh on sh._id = pa.shop_id
-
-            WHERE pa.deleted = {False}
-            GROUP BY 1
-            HAVING MIN(pa.price) > 0
+        json_agg({product_str} ORDER BY cp.availabilities_min_price) as products
             
-            ) pa on p._id = pa.product_id
+        FROM catalog_products cp
 
-        WHERE c.name = '{CATEGORIES[category]}' and p.deleted = {False}
+        {where_str}
         """
 
-    connection = sql_connection()
-    cursor = connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute(query)
-    products_dict = dict(cursor.fetchone())
-    connection.close()
+    with sql_connection(readonly=True) as connection:
+        with connection.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+            cursor.execute(query, (CATEGORIES[category],))
+            products_dict = dict(cursor.fetchone())
 
     valid_messages.petition_completed(f"get_product_from_category: {category}")
     return {"category": category, "products": products_dict["products"]}
@@ -1,46 +1,22 @@
+import datetime
 import logging
-import os
-import warnings
 
+import numpy as np
+import pandas as pd
 import utils.error_messages as errors
 import utils.valid_messages as valid_messages
 from database.stockfinder_models.base import Session
 from database.stockfinder_models.Product import Product
+from database.timeseries import get_timeseries
 from flask import Blueprint
-from influxdb_client import InfluxDBClient
-from influxdb_client.client.warnings import MissingPivotFunction
-
-warnings.simplefilter("ignore", MissingPivotFunction)
+from utils.response_cache import cached_response
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 logger.propagate = True
 
-HOSTNAME = os.environ.get("HOSTNAME", False)
-INFLUXDB_LOCAL_URL = os.environ.get("INFLUXDB_LOCAL_URL")
-INFLUXDB_REMOTE_URL = os.environ.get("INFLUXDB_REMOTE_URL")
-INFLUXDB_TOKEN = os.environ.get("INFLUXDB_TOKEN")
-INFLUXDB_BUCKET = os.environ.get("INFLUXDB_BUCKET")
-INFLUXDB_ORG = os.environ.get("INFLUXDB_ORG")
-
-
-def get_influx_url():
-    """
-    Returns the influxDB URL depending of the hostname/environment.
-
-    :return: string of influxDB URL
-    """
-
-    if HOSTNAME == "Docker":
-        # Localhost / Docker
-        return INFLUXDB_LOCAL_URL
-    else:
-        # Remote Host
-        return INFLUXDB_REMOTE_URL
-
-
-client = InfluxDBClient(url=get_influx_url(), token=INFLUXDB_TOKEN, org=INFLUXDB_ORG)
-query_api = client.query_api()
+## Discount buckets, largest first: a product is in the first one its current price reaches
+DISCOUNT_PERCENTS = [50, 40, 30, 20]
 
 oportunity_routing_blueprint = Blueprint("oportunity_routing", __name__)
 
@@ -61,84 +37,45 @@ def get_image(images):
 
 
 @oportunity_routing_blueprint.route("/get_oportunities", methods=["GET"])
+@cached_response
 def get_oportinities():
     """
     Returns the products with a discount greater than 20%.
 
     :return: dictionary of products (uuid, name, shop, price and image)
     """
-    remove_columns = ["table", "result", "_start", "_stop", "_field", "_measurement", "shop"]
-    query = f"""
-        from(bucket:"{INFLUXDB_BUCKET}")
-            |> range(start: -7d, stop: -1d) // Retrieve data for the last 7 days
-            |> filter(fn: (r) => r["_measurement"] == "prices")
-            |> filter(fn: (r) => r["_field"] == "price")
-            |> group(columns: ["uuid"])
-            |> min(column: "_value")
-            |> yield(name: "min_price")
-        """
-    min_price_table = query_api.query_data_frame(query=query)
-    min_price_table = min_price_table.drop(columns=remove_columns)
-
-    min_prices = {}
-
-    for index, row in min_price_table.iterrows():
-        product_uuid = row["uuid"]
-        price = float(row["_value"])
-
-        if product_uuid not in min_prices:
-            min_prices[product_uuid] = {"price": price}
-
-    remove_columns = ["table", "result", "_start", "_stop", "_field", "_measurement"]
-    query = f"""
-        from(bucket:"{INFLUXDB_BUCKET}")
-            |> range(start: -1d) // Retrieve data for the last 1 day (current day)
-            |> filter(fn: (r) => r["_measurement"] == "prices")
-            |> filter(fn: (r) => r["_field"] == "price")
-            |> group(columns: ["uuid"])
-            |> min(column: "_value")
-            |> yield(name: "current_price")
-        """
-    current_price_table = query_api.query_data_frame(query=query)
-    current_price_table = current_price_table.drop(columns=remove_columns)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    # Min price of the last 7 days (except the current day) and of the current day
+    min_prices = get_timeseries().min_by_uuid(now - datetime.timedelta(days=7), now - datetime.timedelta(days=1))
+    current_prices = get_timeseries().current_min_by_uuid(now - datetime.timedelta(days=1))
 
     result = {20: [], 30: [], 40: [], 50: []}
-    # Iterate over the 'current_price' table and compare with the minimum prices
-    session = Session()
-    for index, row in current_price_table.iterrows():
-        shop = row["shop"]
-        product_uuid = row["uuid"]
-        current_price = float(row["_value"])
-
-        if product_uuid not in min_prices:
-            continue
-
-        lowest_price = min_prices[product_uuid]["price"]
-        product = {"uuid": product_uuid, "shop": shop, "price": current_price}
-        percent = 0
-        if current_price <= lowest_price * 0.5:
-            percent = 50
+    if not min_prices or not current_prices:
+        return result
 
-        elif current_price <= lowest_price * 0.6:
-            percent = 40
+    # Current prices joined with the minimum prices, every product gets the largest discount it reaches
+    current = pd.DataFrame([(product_uuid, shop, price) for product_uuid, (shop, price) in current_prices.items()], columns=["uuid", "shop", "price"])
+    current["lowest_price"] = current["uuid"].map(min_prices)
+    current = current[current["lowest_price"].notna()]
 
-        elif current_price <= lowest_price * 0.7:
-            percent = 30
+    conditions = [current["price"] <= current["lowest_price"] * ((100 - percent) / 100) for percent in DISCOUNT_PERCENTS]
+    current["percent"] = np.select(conditions, DISCOUNT_PERCENTS, default=0)
+    discounted = current[current["percent"] > 0]
+    if discounted.empty:
+        return result
 
-        elif current_price <= lowest_price * 0.8:
-            percent = 20
-
-        else:
-            continue
-
-        if percent == 0:
+    session = Session()
+    try:
+        rows = session.query(Product.uuid, Product.name, Product.images).filter(Product.uuid.in_(discounted["uuid"].tolist())).all()
+    finally:
+        session.close()
+    db_products = {str(product_uuid): (name, images) for product_uuid, name, images in rows}
+
+    for product_uuid, shop, price, percent in zip(discounted["uuid"], discounted["shop"], discounted["price"], discounted["percent"]):
+        if product_uuid not in db_products:
             continue
 
-        db_product = session.query(Product).filter(Product.uuid == product_uuid).first()
-        product["name"] = db_product.name
-        product["image"] = get_image(db_product.images)
-        result[percent].append(product)
-        continue
+        name, images = db_products[product_uuid]
+        result[int(percent)].append({"uuid": product_uuid, "shop": shop, "price": float(price), "name": name, "image": get_image(images)})
 
-    session.close()
     return result
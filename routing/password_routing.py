@@ -8,6 +8,7 @@ import models.jwt.JwtToken as Token
 import models.password.password_data as password_data
 import utils.error_messages as errors
 import utils.valid_messages as valid_messages
+from database.db_connection import primary_engine
 from database.stockfinder_models.base import Session
 from database.stockfinder_models.User import User
 from flask import Blueprint, request
@@ -51,7 +52,7 @@ def email_password_reset():
         return generate_error_data(email_verification_error, user_ip=user_data["user_ip"]), HTTPStatus.UNAUTHORIZED
 
     # RESET PASSWORD ONCE EACH 24 HOURS
-    session = Session()
+    session = Session(bind=primary_engine())
     user_found = session.query(User).filter(User.email == user_data["email"]).first()
     if not user_found:
         session.close()
@@ -100,7 +101,7 @@ def password_reset():
     telegram_id = decoded_token[password_data.TELEGRAM_ID] if decoded_token[password_data.TELEGRAM_ID] else None
 
     # RESET PASSWORD ONCE EACH 24 HOURS
-    session = Session()
+    session = Session(bind=primary_engine())
     if telegram_id:
         logger.warning(telegram_id)
         user_db_data = session.query(User).filter(and_(User.email == email, User.telegram == int(telegram_id))).first()
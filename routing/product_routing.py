@@ -1,165 +1,195 @@
 import datetime
 import logging
 import os
-import socket
-import warnings
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
 from uuid import UUID
 
-import pandas as pd
 import psycopg2
 import psycopg2.extras
-import pytz
 import utils.error_messages as errors
 import utils.valid_messages as valid_messages
 from database.db_connection import sql_connection
-from flask import Blueprint
-from influxdb_client import InfluxDBClient
-from influxdb_client.client.warnings import MissingPivotFunction
-
-warnings.simplefilter("ignore", MissingPivotFunction)
+from database.timeseries import get_timeseries
+from flask import Blueprint, request
+from utils.error_messages_management import generate_error_data
+from utils.price_history import compact_history_chart
+from utils.price_history_cache import PRICE_HISTORY_DAYS, history_chart, price_history_cache
+from utils.response_cache import cached_response
+from utils.server_timing import add_timing, timed_call
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 logger.propagate = True
 
-HOSTNAME = os.environ.get("HOSTNAME", False)
-INFLUXDB_LOCAL_URL = os.environ.get("INFLUXDB_LOCAL_URL")
-INFLUXDB_REMOTE_URL = os.environ.get("INFLUXDB_REMOTE_URL")
-INFLUXDB_TOKEN = os.environ.get("INFLUXDB_TOKEN")
-INFLUXDB_BUCKET = os.environ.get("INFLUXDB_BUCKET")
-INFLUXDB_ORG = os.environ.get("INFLUXDB_ORG")
-
-
-def get_influx_url():
-    """
-    Returns the influxDB URL depending of the hostname/environment.
-
-    :return: string of influxDB URL
-    """
-
-    if HOSTNAME == "Docker":
-        # Localhost / Docker
-        return INFLUXDB_LOCAL_URL
-    else:
-        # Remote Host
-        return INFLUXDB_REMOTE_URL
+PRODUCT_LOOKUP_WORKERS = int(os.environ.get("PRODUCT_LOOKUP_WORKERS", 8))
+PRODUCTS_BATCH_MAX_UUIDS = int(os.environ.get("PRODUCTS_BATCH_MAX_UUIDS", 50))
 
+## Days of every price history range (?range=), None is the whole history
+HISTORY_RANGES = {"7d": 7, "30d": 30, "90d": 90, "365d": 365, "all": None}
 
-client = InfluxDBClient(url=get_influx_url(), token=INFLUXDB_TOKEN, org=INFLUXDB_ORG)
-query_api = client.query_api()
+## PostgreSQL and time series lookups of the product pages
+product_lookup_pool = ThreadPoolExecutor(max_workers=PRODUCT_LOOKUP_WORKERS, thread_name_prefix="product_lookup")
 
 product_routing_blueprint = Blueprint("product_routing", __name__)
 
 
-@product_routing_blueprint.route("/api/product/<string:uuid>", methods=["GET"])
-def get_product(uuid):
+def get_products_data(uuids):
     """
-    Returns the product matching the uuid.
+    Returns the product data (PostgreSQL) of the uuids in one query.
 
-    :param uuid: identify the product
-    :return: dictionary the product specifications
+    :param uuids: list of product UUIDs
+    :return: dictionary {uuid: product data}, products that do not exist are missing
     """
-    if not uuid:
-        return {}
-
-    try:
-        uuid = str(uuid)
-        uuid = UUID(uuid, version=4)
-    except:
-        logger.error(errors.UUID_NOT_VALID)
-        logger.error(uuid)
-        return {}
-
     image_str = "'images', COALESCE(images#>>'{large}',images#>>'{medium}')"
 
     query = f"""
-                SELECT 
+                SELECT p.uuid::text AS uuid,
 
-                json_agg(json_build_object('name', p.name, {image_str}, 'manufacturer', m.name, 'specifications', ps.specs, 'availabilities', availability, 'category', c.name)) as product_data
+                json_build_object('name', p.name, {image_str}, 'manufacturer', m.name, 'specifications', ps.specs, 'availabilities', pa.availability, 'category', c.name) as product_data
 
-                    
                 FROM products p
                 LEFT JOIN categories c on p.category_id = c._id 
                 LEFT JOIN manufacturers m on p.manufacturer_id = m._id
-                JOIN (
-                    SELECT product_id, json_object_agg(sp.name,ps.value) AS specs
-                    FROM product_specs ps
-                    LEFT JOIN specs sp on ps.spec_id = sp._id
-                    WHERE ps.value != 'None'
-                    GROUP BY 1
-                    ) ps on ps.product_id = p._id
-                JOIN (
-                    SELECT product_id, json_agg(json_build_object('shopName', sh.name, 'price', pa.price, 'stock', pa.stock, 'url', pa.url, 'outlet', pa.outlet)) as availability
+                JOIN product_specs_documents ps on ps.product_id = p._id
+                JOIN LATERAL (
+                    SELECT json_agg(json_build_object('shopName', sh.name, 'price', pa.price, 'stock', pa.stock, 'url', pa.url, 'outlet', pa.outlet)) as availability
                     FROM products_availabilities pa
                     LEFT JOIN shops sh on sh._id = pa.shop_id
-                    WHERE pa.price > 0
-                    GROUP BY product_id
-                    ) pa on p._id = pa.product_id
+                    WHERE pa.product_id = p._id AND pa.price > 0
+                    ) pa on pa.availability IS NOT NULL
 
-                WHERE p.uuid = '{uuid}'
+                WHERE p.uuid = ANY(%s::uuid[])
             """
 
-    connection = sql_connection()
-    cursor = connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute(query)
-    product_dict = dict(cursor.fetchone())
-    connection.close()
+    with sql_connection(readonly=True) as connection:
+        with connection.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+            cursor.execute(query, ([str(uuid) for uuid in uuids],))
+            return {row["uuid"]: row["product_data"] for row in cursor.fetchall()}
 
-    if not product_dict or product_dict["product_data"] == None:
-        logger.warning(f"No hay datos del producto {product_dict}")
-        return {}
 
-    product_dict = product_dict["product_data"][0]
+def get_product_data(uuid):
+    """
+    Returns the product data (PostgreSQL) of the uuid.
 
-    params = {
-        # "_start": datetime.datetime(2022, 1, 1).astimezone(pytz.timezone("CET")),
-        "_start": datetime.datetime.now(pytz.timezone("CET")) - datetime.timedelta(days=365),
-        "_end": datetime.datetime.now(pytz.timezone("CET")),
-    }
+    :param uuid: product UUID
+    :return: dictionary or None if the product does not exist
+    """
+    product_data = get_products_data([uuid]).get(str(uuid))
+    if product_data is None:
+        logger.warning(f"No hay datos del producto {uuid}")
 
-    query = f"""
-        from(bucket:"{INFLUXDB_BUCKET}")
-        |> range(start: _start, stop: now())
-        |> filter(fn: (r) => r["_measurement"] == "prices" and r["uuid"] == "{str(uuid)}")
-        |> aggregateWindow(every: 1d, fn: min, createEmpty: false)
-        |> yield(name: "prices")
-        """
-
-    historical_prices = {}
-    try:
-        labels = []
-        datasets = []
+    return product_data
+
+
+def history_chart_data(history, points):
+    """
+    Returns the chart of a history of the cache: compact and downsampled when points is given.
+    """
+    if points:
+        return compact_history_chart(*history, points)
+    return history_chart(*history)
+
+
+def get_price_history(uuid, days=PRICE_HISTORY_DAYS, points=None):
+    """
+    Returns the price history chart (time series backend) of the uuid.
+    Only the days since the last finalized one are read from the backend (utils/price_history_cache.py).
+
+    :param uuid: product UUID
+    :param days: days of history, None for the whole history
+    :param points: max points of every shop, the chart is downsampled and compact when given
+    :return: dictionary {"labels": [...], "datasets": [...]} or {"start": ..., "datasets": [...]} when compact
+    """
+
+    def fetch_history(start):
+        return get_timeseries().daily_min_by_shop(uuid, datetime.datetime.combine(start, datetime.time(), tzinfo=datetime.timezone.utc))
 
-        df = query_api.query_data_frame(query=query, params=params)
-        remove_columns = ["table", "result", "_start", "_stop", "_field", "_measurement", "uuid"]
-        df = df.drop(columns=remove_columns)
+    return history_chart_data(price_history_cache.get_history(str(uuid), fetch_history, days), points)
 
-        df_min_values = df.groupby(["_time", "shop"]).min().reset_index()
-        shop_counts = df.groupby(["shop"]).size().to_dict()
-        date_list = df_min_values["_time"].unique().tolist()
 
-        labels_check = False
-        for shop in shop_counts:
-            data_dict = {"label": shop, "data": []}
-            for date in date_list:
-                if not labels_check:
-                    formatted_date = date.strftime("%Y-%m-%d")
-                    if formatted_date not in labels:
-                        labels.append(formatted_date)
+def get_price_histories(uuids, days=PRICE_HISTORY_DAYS, points=None):
+    """
+    Returns the price history charts of the uuids, read from the time series backend in at most two queries
+    (products without cached history and cached ones, see PriceHistoryCache.get_histories).
+
+    :param uuids: list of product UUIDs
+    :param days: days of history, None for the whole history
+    :param points: max points of every shop, the charts are downsampled and compact when given
+    :return: dictionary {uuid: chart}
+    """
+
+    def fetch_histories(fetched_uuids, start):
+        return get_timeseries().daily_min_by_shop_many(fetched_uuids, datetime.datetime.combine(start, datetime.time(), tzinfo=datetime.timezone.utc))
+
+    histories = price_history_cache.get_histories([str(uuid) for uuid in uuids], fetch_histories, days)
+    return {uuid: history_chart_data(history, points) for uuid, history in histories.items()}
+
+
+def parse_history_args(args):
+    """
+    Returns the days (?range=) and points (?points=) of the price history requested.
+
+    :param args: request arguments
+    :return: tuple (days, points)
+    :raise ValueError: if a parameter is not valid
+    """
+    days = PRICE_HISTORY_DAYS
+    if "range" in args:
+        if args["range"] not in HISTORY_RANGES:
+            raise ValueError(args["range"])
+        days = HISTORY_RANGES[args["range"]]
 
-                values = df_min_values.loc[(df_min_values["_time"] == date) & (df_min_values["shop"] == shop), "_value"]
-                if values.empty:
-                    value = None
-                else:
-                    value = values.iloc[0]
+    points = None
+    if "points" in args:
+        points = int(args["points"])
+        if points < 2:
+            raise ValueError(points)
 
-                data_dict["data"].append(value)
+    return days, points
+
+
+@product_routing_blueprint.route("/api/product/<string:uuid>", methods=["GET"])
+@cached_response
+def get_product(uuid):
+    """
+    Returns the product matching the uuid.
+    PostgreSQL and the time series backend are queried at the same time, their durations are sent in the Server-Timing header.
+    The price history covers the range of ?range= (7d, 30d, 90d, 365d or all). With ?points= every shop
+    is downsampled to that many points and only has the days it has a price.
+
+    :param uuid: identify the product
+    :return: dictionary the product specifications
+    """
+    if not uuid:
+        return {}
 
-            labels_check = True
-            datasets.append(data_dict)
+    try:
+        uuid = str(uuid)
+        uuid = UUID(uuid, version=4)
+    except:
+        logger.error(errors.UUID_NOT_VALID)
+        logger.error(uuid)
+        return {}
 
-        historical_prices = {"labels": labels, "datasets": datasets}
+    try:
+        days, points = parse_history_args(request.args)
+    except ValueError:
+        return generate_error_data(errors.PARAM_NOT_VALID), HTTPStatus.UNAUTHORIZED
+
+    product_future = product_lookup_pool.submit(timed_call, get_product_data, uuid)
+    history_future = product_lookup_pool.submit(timed_call, get_price_history, uuid, days, points)
+
+    product_dict, duration = product_future.result()
+    add_timing("pg", duration)
+    if not product_dict:
+        # The history lookup may already be running, it does not cache anything for unknown uuids
+        history_future.cancel()
+        return {}
 
+    try:
+        historical_prices, duration = history_future.result()
+        add_timing("history", duration)
     except:
         logger.error(errors.HISTORICAL_PRICES_NOT_GATHERED)
         return product_dict
@@ -167,3 +197,48 @@ def get_product(uuid):
     product_dict["historical_prices"] = historical_prices
     valid_messages.petition_completed(f"product: {uuid}")
     return product_dict
+
+
+@product_routing_blueprint.route("/api/products", methods=["GET"])
+@cached_response
+def get_products():
+    """
+    Returns the products of the uuids (?uuids=, comma separated) keyed by uuid.
+    With ?history=1 every product has its price history (?range= and ?points= as in /api/product),
+    read from the time series backend (one query per cold/warm group) at the same time as PostgreSQL.
+
+    :return: dictionary {"products": {uuid: product}}, products that do not exist are missing
+    """
+    uuids = []
+    try:
+        for uuid in request.args.get("uuids", "").split(","):
+            if uuid.strip():
+                uuids.append(str(UUID(uuid.strip(), version=4)))
+        days, points = parse_history_args(request.args)
+    except ValueError:
+        return generate_error_data(errors.PARAM_NOT_VALID), HTTPStatus.UNAUTHORIZED
+
+    uuids = list(dict.fromkeys(uuids))
+    if not uuids or len(uuids) > PRODUCTS_BATCH_MAX_UUIDS:
+        return generate_error_data(errors.PARAM_NOT_VALID), HTTPStatus.UNAUTHORIZED
+
+    products_future = product_lookup_pool.submit(timed_call, get_products_data, uuids)
+    histories_future = None
+    if request.args.get("history", "0") == "1":
+        histories_future = product_lookup_pool.submit(timed_call, get_price_histories, uuids, days, points)
+
+    products, duration = products_future.result()
+    add_timing("pg", duration)
+
+    if histories_future is not None:
+        try:
+            histories, duration = histories_future.result()
+            add_timing("history", duration)
+        except:
+            logger.error(errors.HISTORICAL_PRICES_NOT_GATHERED)
+        else:
+            for uuid, product in products.items():
+                product["historical_prices"] = histories[uuid]
+
+    valid_messages.petition_completed(f"products: {len(products)}/{len(uuids)}")
+    return {"products": products}
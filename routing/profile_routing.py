@@ -7,6 +7,7 @@ import models.auth.auth_data as auth_data
 import models.jwt.JwtToken as Token
 import utils.error_messages as errors
 import utils.valid_messages as valid_messages
+from database.db_connection import primary_engine
 from database.stockfinder_models.Alert import Alert
 from database.stockfinder_models.Availability import Availability
 from database.stockfinder_models.base import Session
@@ -58,7 +59,7 @@ def register_alert():
             logger.error(uuid)
             return generate_error_data(errors.UUID_NOT_VALID, user_ip=user_data["user_ip"]), HTTPStatus.UNAUTHORIZED
 
-    session = Session()
+    session = Session(bind=primary_engine())
     user_found = session.query(User).filter(User.email == email).first()
     if not user_found:
         session.close()
@@ -268,7 +269,7 @@ def update_alert():
     email = decoded_token[auth_data.EMAIL]
     # telegram = decoded_token[user_data['TELEGRAM_ID]
 
-    session = Session()
+    session = Session(bind=primary_engine())
     user_found = session.query(User).filter(User.email == email).first()
     if not user_found:
         session.close()
@@ -310,7 +311,7 @@ def delete_alert():
     # telegram = int(decoded_token[user_data['TELEGRAM_ID]) if decoded_token[user_data['TELEGRAM_ID] and decoded_token[user_data['TELEGRAM_ID] != "" else None
     alert_id = int(request_body[alert_data.ALERT_ID])
 
-    session = Session()
+    session = Session(bind=primary_engine())
     user_found = session.query(User).filter(User.email == email).first()
     if not user_found:
         session.close()
@@ -6,6 +6,7 @@ import database.db_management.auth_management as auth
 import models.register.register_data as register_data
 import utils.error_messages as errors
 import utils.valid_messages as valid_messages
+from database.db_connection import primary_engine
 from database.stockfinder_models.base import Session
 from database.stockfinder_models.User import User
 from flask import Blueprint, request
@@ -178,7 +179,7 @@ def verify_codes():
 
         hashed_password = generate_password_hash(user_data["password"])
 
-        session = Session()
+        session = Session(bind=primary_engine())
         new_user = User(telegram=None, email=user_data["email"], password=hashed_password)
         session.add(new_user)
         session.commit()
@@ -198,7 +199,7 @@ def verify_codes():
     telegram_code = request_body[register_data.TELEGRAM_CODE]
     if re.match(r"^-[0-9]*$", telegram_id):
         return generate_error_data(errors.TELEGRAM_ID_NOT_VALID, user_ip=user_data["user_ip"]), HTTPStatus.UNAUTHORIZED
-    session = Session()
+    session = Session(bind=primary_engine())
     user_found = session.query(User).filter(User.telegram == str(telegram_id)).first()
     if user_found:
         if user_found.__dict__.get("email", False):
@@ -258,7 +259,7 @@ def verify_telegram_code():
     telegram_code = request_body[register_data.TELEGRAM_CODE]
     if re.match(r"^-[0-9]*$", telegram_id):
         return generate_error_data(errors.TELEGRAM_ID_NOT_VALID, user_ip=user_data["user_ip"]), HTTPStatus.UNAUTHORIZED
-    session = Session()
+    session = Session(bind=primary_engine())
     user_found = session.query(User).filter(User.telegram == str(telegram_id)).first()
     if user_found:
         if user_found.__dict__.get("email", False):
@@ -5,6 +5,8 @@ import psycopg2.extras
 import utils.valid_messages as valid_messages
 from database.db_connection import sql_connection
 from flask import Blueprint, request
+from utils.etag import catalog_etag
+from utils.response_cache import cached_response
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -15,6 +17,8 @@ telegram_routing_blueprint = Blueprint("telegram_routing", __name__)
 
 
 @telegram_routing_blueprint.route("/api/telegram_channels", methods=["GET"])
+@catalog_etag
+@cached_response
 def get_telegram_channels():
     """
     Get the existing telegram channels.
@@ -31,11 +35,10 @@ def get_telegram_channels():
                 GROUP BY channel_name, tc.image,  tc.url
             """
 
-    connection = sql_connection()
-    cursor = connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cursor.execute(query)
-    data = cursor.fetchall()
-    connection.close()
+    with sql_connection(readonly=True) as connection:
+        with connection.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+            cursor.execute(query)
+            data = cursor.fetchall()
 
     telegram_dict = {}
     for index in range(len(data)):
@@ -5,6 +5,7 @@ import models.auth.auth_data as auth_data
 import models.jwt.JwtToken as Token
 import utils.error_messages as errors
 import utils.valid_messages as valid_messages
+from database.db_connection import primary_engine
 from database.stockfinder_models.Alert import Alert
 from database.stockfinder_models.base import Session
 from database.stockfinder_models.Message import Message
@@ -191,7 +192,7 @@ def delete_user():
         return generate_error_data(errors.TOKEN_INVALID, user_ip=user_data["user_ip"]), HTTPStatus.UNAUTHORIZED
 
     email = decoded_token[auth_data.EMAIL]
-    session = Session()
+    session = Session(bind=primary_engine())
     user_found = session.query(User).filter(User.email == email).first()
     if not user_found:
         session.close()
@@ -1,8 +1,9 @@
 import os
 
 import flask
+from database.db_management.catalog_management import start_catalog_refresher, start_ngram_indexer
 from flask_cors import CORS
-from routing.apistock_routing import apistock_routing_blueprint
+from routing.apistock_routing import CATEGORIES, SPECS_VALUES, apistock_routing_blueprint
 from routing.auth_routing import auth_routing_blueprint
 from routing.builds_routing import build_routing_blueprint
 from routing.oportunity_routing import oportunity_routing_blueprint
@@ -12,6 +13,9 @@ from routing.profile_routing import profile_routing_blueprint
 from routing.register_routing import register_routing_blueprint
 from routing.telegram_routing import telegram_routing_blueprint
 from routing.user_routing import user_routing_blueprint
+from utils.compression import init_compression
+from utils.server_timing import init_server_timing
+from utils.warmup import init_warmup, start_warmup
 
 SECRET_KEY = os.environ.get("FLASK_AUTH_SECRET")
 
@@ -20,6 +24,8 @@ app = flask.Flask(__name__)
 app.config["DEBUG"] = True
 app.config["SECRET_KEY"] = SECRET_KEY
 CORS(app)
+init_compression(app)
+init_server_timing(app)
 
 spams = {}
 
@@ -38,5 +44,12 @@ app.register_blueprint(telegram_routing_blueprint, url_prefix="/")
 #
 app.register_blueprint(oportunity_routing_blueprint, url_prefix="/api")
 
+## Responses precomputed when the worker starts and when the catalog changes
+WARMUP_PATHS = [f"/api/category/{category}" for category in CATEGORIES] + [f"/api/stock/{model}" for model in SPECS_VALUES] + ["/api/deals", "/api/telegram_channels"]
+init_warmup(app, WARMUP_PATHS)
+start_catalog_refresher()
+start_ngram_indexer()
+
 if __name__ == "__main__":
+    start_warmup(app)
     app.run(debug=True)
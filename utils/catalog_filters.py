@@ -0,0 +1,67 @@
+## Sort orders of the catalog listings: descending or not
+CATALOG_SORTS = {"price": False, "-price": True}
+
+## Boolean query arguments
+BOOLEAN_VALUES = {"1": True, "true": True, "0": False, "false": False}
+
+
+def parse_boolean(value):
+    result = BOOLEAN_VALUES.get(value.lower(), None)
+    if result is None:
+        raise ValueError(f"Invalid boolean: {value}")
+    return result
+
+
+def parse_number(value):
+    number = float(value)
+    if number != number or number in (float("inf"), float("-inf")):
+        raise ValueError(f"Invalid number: {value}")
+    return number
+
+
+def parse_catalog_filters(args, facets=()):
+    """
+    Returns the SQL conditions on catalog_products (cp) of the listing filters of a request:
+    ?min_price=&max_price=&manufacturer=A,B&stock=1&refurbished=0&min_<facet>=&max_<facet>=&sort=price|-price
+    Numeric facets are matched through the indexed product_numeric_specs rows.
+
+    :param args: request query arguments
+    :param facets: numeric facets of the category (database/product_numeric_specs.sql)
+    :return: tuple (conditions string, empty or starting with AND, parameters, descending order)
+    """
+    conditions = []
+    params = ()
+
+    if args.get("min_price", None):
+        conditions.append("cp.price >= %s")
+        params += (parse_number(args["min_price"]),)
+    if args.get("max_price", None):
+        conditions.append("cp.price <= %s")
+        params += (parse_number(args["max_price"]),)
+
+    manufacturers = [manufacturer.strip() for manufacturer in args.get("manufacturer", "").split(",") if manufacturer.strip()]
+    if manufacturers:
+        conditions.append("cp.manufacturer = ANY(%s)")
+        params += (manufacturers,)
+
+    if args.get("stock", None):
+        conditions.append("cp.stock = %s")
+        params += (1 if parse_boolean(args["stock"]) else 0,)
+    if args.get("refurbished", None):
+        conditions.append("cp.refurbished = %s")
+        params += (parse_boolean(args["refurbished"]),)
+
+    for facet in facets:
+        for bound, operator in (("min", ">="), ("max", "<=")):
+            value = args.get(f"{bound}_{facet}", None)
+            if not value:
+                continue
+            conditions.append(f"EXISTS (SELECT 1 FROM product_numeric_specs n WHERE n.product_id = cp.product_id AND n.facet = %s AND n.value {operator} %s)")
+            params += (facet, parse_number(value))
+
+    sort = args.get("sort", "price")
+    if sort not in CATALOG_SORTS:
+        raise ValueError(f"Invalid sort: {sort}")
+
+    conditions_str = "".join(f" AND {condition}" for condition in conditions)
+    return conditions_str, params, CATALOG_SORTS[sort]
@@ -0,0 +1,442 @@
+import json
+import os
+
+import numpy as np
+
+MANIFEST_FILE = "manifest.json"
+
+
+def encode_strings(values):
+    """
+    Dictionary encodes a list of strings.
+
+    :example:
+    >>> codes, dictionary = encode_strings(["GPU", "CPU", None, "GPU"])
+    >>> codes.tolist(), dictionary
+    ([0, 1, -1, 0], ['GPU', 'CPU'])
+
+    :param values: list of strings (None allowed)
+    :return: tuple (int32 array of codes, -1 for None, list of distinct strings)
+    """
+    index = {}
+    codes = np.empty(len(values), dtype=np.int32)
+    for position, value in enumerate(values):
+        codes[position] = -1 if value is None else index.setdefault(value, len(index))
+    return codes, list(index)
+
+
+def float_array(values):
+    return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+
+
+def first_per_group(groups):
+    """
+    Returns the positions where a new group starts in a sorted array of groups.
+
+    :param groups: sorted array
+    :return: bool array
+    """
+    first = np.ones(len(groups), dtype=bool)
+    first[1:] = groups[1:] != groups[:-1]
+    return first
+
+
+class StringColumn:
+    """
+    Column of strings stored as one UTF-8 buffer and offsets, so it can be saved as NumPy arrays
+    and memory mapped. Values are decoded when they are read.
+
+    :example:
+    >>> column = StringColumn.from_values(["RTX", None, "Radeon"])
+    >>> [column[i] for i in range(len(column))]
+    ['RTX', None, 'Radeon']
+    """
+
+    def __init__(self, data, offsets, valid):
+        self.data = data
+        self.offsets = offsets
+        self.valid = valid
+
+    @classmethod
+    def from_values(cls, values):
+        encoded = [b"" if value is None else cls.encode(value) for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        valid = np.array([value is not None for value in values], dtype=bool)
+        return cls(data, offsets, valid)
+
+    @staticmethod
+    def encode(value):
+        return value.encode()
+
+    @staticmethod
+    def decode(value):
+        return value.decode()
+
+    def __len__(self):
+        return len(self.valid)
+
+    def __getitem__(self, position):
+        if not self.valid[position]:
+            return None
+        return self.decode(self.data[self.offsets[position] : self.offsets[position + 1]].tobytes())
+
+    def __iter__(self):
+        return (self[position] for position in range(len(self)))
+
+    def arrays(self, name):
+        return {f"{name}.data": self.data, f"{name}.offsets": self.offsets, f"{name}.valid": self.valid}
+
+    @classmethod
+    def from_arrays(cls, arrays, name):
+        return cls(arrays[f"{name}.data"], arrays[f"{name}.offsets"], arrays[f"{name}.valid"])
+
+
+class JsonColumn(StringColumn):
+    """
+    Column of JSON documents (specs, shops, availabilities), parsed when they are read.
+    """
+
+    @staticmethod
+    def encode(value):
+        return json.dumps(value, separators=(",", ":")).encode()
+
+    @staticmethod
+    def decode(value):
+        return json.loads(value)
+
+
+## Columns of the snapshot: NumPy arrays, strings and JSON documents
+ARRAY_COLUMNS = (
+    "product_ids",
+    "category_codes",
+    "refurbished",
+    "deleted",
+    "manufacturer_codes",
+    "has_specs",
+    "shops_min_prices",
+    "availabilities_min_prices",
+    "prices",
+    "stock",
+    "gpu_value_codes",
+    "offer_products",
+    "offer_shop_codes",
+    "offer_prices",
+    "in_stock_min_prices",
+)
+STRING_COLUMNS = ("uuids", "names", "images", "categories", "manufacturers", "gpu_values", "shops")
+JSON_COLUMNS = ("specs", "shops_lists", "availabilities")
+
+
+class CatalogSnapshot:
+    """
+    Columnar copy of the catalog: products (catalog_products), their GPU model spec value, their numeric
+    facets and their sellable availabilities (not deleted, in stock, price > 0).
+    Repeated strings are dictionary encoded, numbers are NumPy arrays and the endpoints filter,
+    aggregate and sort them with vectorized operations.
+
+    Every column is a NumPy array (strings and JSON as buffer + offsets), so a snapshot can be saved
+    once and memory mapped read-only by every worker (save / load).
+    """
+
+    def __init__(self, version, columns, facets):
+        """
+        :param version: catalog version of the data
+        :param columns: dict {name: array, StringColumn or JsonColumn} (ARRAY_COLUMNS, STRING_COLUMNS, JSON_COLUMNS)
+        :param facets: dict {facet: float array aligned with the products, NaN without value}
+        """
+        self.version = version
+        self.columns = columns
+        self.facets = facets
+        for name, column in columns.items():
+            setattr(self, name, column)
+
+        # Dictionaries are small, they are decoded once
+        self.categories = list(columns["categories"])
+        self.manufacturers = list(columns["manufacturers"])
+        self.gpu_values = list(columns["gpu_values"])
+        self.shops = list(columns["shops"])
+        self.gpu_value_index = {value: code for code, value in enumerate(self.gpu_values)}
+
+    @classmethod
+    def from_rows(cls, version, products, availabilities, facets):
+        """
+        Builds a snapshot from the rows read from PostgreSQL.
+
+        :param version: catalog version of the data
+        :param products: rows (product_id, category, uuid, name, refurbished, deleted, image, manufacturer,
+            specs, shops, shops_min_price, availabilities, availabilities_min_price, price, stock, gpu_value)
+        :param availabilities: rows (product_id, shop, price) of the sellable availabilities
+        :param facets: rows (product_id, facet, value) of product_numeric_specs
+        :return: CatalogSnapshot
+        """
+        product_columns = list(zip(*products)) if products else [()] * 16
+        columns = {}
+        columns["product_ids"] = np.array(product_columns[0], dtype=np.int64)
+        columns["category_codes"], categories = encode_strings(product_columns[1])
+        columns["uuids"] = StringColumn.from_values(product_columns[2])
+        columns["names"] = StringColumn.from_values(product_columns[3])
+        columns["refurbished"] = np.array([bool(value) for value in product_columns[4]], dtype=bool)
+        columns["deleted"] = np.array([bool(value) for value in product_columns[5]], dtype=bool)
+        columns["images"] = StringColumn.from_values(product_columns[6])
+        columns["manufacturer_codes"], manufacturers = encode_strings(product_columns[7])
+        columns["specs"] = JsonColumn.from_values(product_columns[8])
+        columns["has_specs"] = np.array([value is not None for value in product_columns[8]], dtype=bool)
+        columns["shops_lists"] = JsonColumn.from_values(product_columns[9])
+        columns["shops_min_prices"] = float_array(product_columns[10])
+        columns["availabilities"] = JsonColumn.from_values(product_columns[11])
+        columns["availabilities_min_prices"] = float_array(product_columns[12])
+        columns["prices"] = float_array(product_columns[13])
+        columns["stock"] = np.array([-1 if value is None else value for value in product_columns[14]], dtype=np.int8)
+        columns["gpu_value_codes"], gpu_values = encode_strings(product_columns[15])
+
+        positions = {product_id: position for position, product_id in enumerate(product_columns[0])}
+
+        # Availabilities of unknown products (not refreshed yet) are ignored
+        offers = [(positions[row[0]], row[1], row[2]) for row in availabilities if row[0] in positions]
+        offer_columns = list(zip(*offers)) if offers else [()] * 3
+        columns["offer_products"] = np.array(offer_columns[0], dtype=np.int32)
+        columns["offer_shop_codes"], shops = encode_strings(offer_columns[1])
+        columns["offer_prices"] = np.array(offer_columns[2], dtype=np.float64)
+
+        columns["in_stock_min_prices"] = np.full(len(positions), np.inf)
+        np.minimum.at(columns["in_stock_min_prices"], columns["offer_products"], columns["offer_prices"])
+
+        columns["categories"] = StringColumn.from_values(categories)
+        columns["manufacturers"] = StringColumn.from_values(manufacturers)
+        columns["gpu_values"] = StringColumn.from_values(gpu_values)
+        columns["shops"] = StringColumn.from_values(shops)
+
+        facet_columns = {}
+        for product_id, facet, value in facets:
+            position = positions.get(product_id, None)
+            if position is None:
+                continue
+            if facet not in facet_columns:
+                facet_columns[facet] = np.full(len(positions), np.nan)
+            facet_columns[facet][position] = value
+
+        return cls(version, columns, facet_columns)
+
+    def save(self, directory):
+        """
+        Writes every column as a .npy file plus a manifest, written last.
+
+        :param directory: empty directory
+        """
+        arrays = {}
+        for name in ARRAY_COLUMNS:
+            arrays[name] = self.columns[name]
+        for name in STRING_COLUMNS + JSON_COLUMNS:
+            arrays.update(self.columns[name].arrays(name))
+        for facet, values in self.facets.items():
+            arrays[f"facet.{facet}"] = values
+
+        for name, array in arrays.items():
+            np.save(os.path.join(directory, f"{name}.npy"), array, allow_pickle=False)
+
+        with open(os.path.join(directory, MANIFEST_FILE), "w") as manifest:
+            json.dump({"version": self.version, "facets": list(self.facets)}, manifest)
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Memory maps (read-only) a snapshot written by save. The pages are shared by every process mapping it.
+
+        :param directory: snapshot directory
+        :return: CatalogSnapshot
+        """
+        with open(os.path.join(directory, MANIFEST_FILE)) as manifest:
+            manifest = json.load(manifest)
+
+        def array(name):
+            return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r", allow_pickle=False)
+
+        arrays = {}
+        for name in STRING_COLUMNS + JSON_COLUMNS:
+            for part in ("data", "offsets", "valid"):
+                arrays[f"{name}.{part}"] = array(f"{name}.{part}")
+
+        columns = {name: array(name) for name in ARRAY_COLUMNS}
+        for name in STRING_COLUMNS:
+            columns[name] = StringColumn.from_arrays(arrays, name)
+        for name in JSON_COLUMNS:
+            columns[name] = JsonColumn.from_arrays(arrays, name)
+
+        facets = {facet: array(f"facet.{facet}") for facet in manifest["facets"]}
+        return cls(manifest["version"], columns, facets)
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    def category_mask(self, category):
+        try:
+            return self.category_codes == self.categories.index(category)
+        except ValueError:
+            return np.zeros(len(self.product_ids), dtype=bool)
+
+    def stock_by_model(self, model_values):
+        """
+        Returns the sellable offers of every model family (same data as get_models_stock).
+
+        :param model_values: dict {model: tuple of GPU model spec values}
+        :return: dict {model: {"min_price", "max_price", "products"}}, models without stock are not included
+        """
+        data = {}
+        for model, values in model_values.items():
+            codes = [self.gpu_value_index[value] for value in values if value in self.gpu_value_index]
+            if not codes:
+                continue
+
+            products_mask = np.isin(self.gpu_value_codes, codes) & ~self.deleted
+            offers = np.flatnonzero(products_mask[self.offer_products])
+            if not len(offers):
+                continue
+
+            # One offer per (product, shop, price), cheapest first
+            combos = np.unique(np.column_stack((self.offer_prices[offers], self.offer_products[offers], self.offer_shop_codes[offers])), axis=0)
+            prices = combos[:, 0].tolist()
+            products = combos[:, 1].astype(np.int64).tolist()
+            shops = combos[:, 2].astype(np.int64).tolist()
+
+            data[model] = {
+                "min_price": prices[0],
+                "max_price": prices[-1],
+                "products": [
+                    {
+                        "uuid": self.uuids[product],
+                        "name": self.names[product],
+                        "price": price,
+                        "shop": self.shops[shop],
+                        "refurbished": bool(self.refurbished[product]),
+                        "image": self.images[product],
+                    }
+                    for price, product, shop in zip(prices, products, shops)
+                ],
+            }
+        return data
+
+    def cheapest_per_gpu_model(self, taxonomy):
+        """
+        Returns the cheapest GPU in stock of every normalized model (same rows as the /api/deals query).
+
+        :param taxonomy: GpuTaxonomy
+        :return: list of dicts {"gpu_model", "value", "price", "product"}
+        """
+        value_models, models = [], {}
+        for value in self.gpu_values:
+            gpu = taxonomy.lookup(value)
+            value_models.append(models.setdefault(gpu.model, len(models)) if gpu else -1)
+        value_models = np.array(value_models + [-1], dtype=np.int32)
+
+        # gpu_value_codes is -1 for products without value: the appended -1 model
+        product_models = value_models[self.gpu_value_codes]
+        candidates = np.flatnonzero(self.category_mask("GPU") & (product_models >= 0) & np.isfinite(self.in_stock_min_prices))
+        if not len(candidates):
+            return []
+
+        order = np.lexsort((self.product_ids[candidates], self.in_stock_min_prices[candidates], product_models[candidates]))
+        ordered = candidates[order]
+        cheapest = ordered[first_per_group(product_models[ordered])]
+
+        model_names = list(models)
+        rows = []
+        for product in cheapest.tolist():
+            price = float(self.in_stock_min_prices[product])
+            rows.append(
+                {
+                    "gpu_model": model_names[product_models[product]],
+                    "value": self.gpu_values[self.gpu_value_codes[product]],
+                    "price": price,
+                    "product": {"uuid": self.uuids[product], "name": self.names[product], "image": self.images[product], "price": price},
+                }
+            )
+        return rows
+
+    def search_products(self):
+        """
+        Returns the products searchable by /api/search (not deleted, sold by some shop) ordered by uuid,
+        as the SQL search returns them.
+
+        :return: list of dicts (uuid, name, category, image, price, stock)
+        """
+        selected = np.flatnonzero(~self.deleted & (self.shops_min_prices > 0)).tolist()
+        selected.sort(key=lambda product: self.uuids[product])
+        return [
+            {
+                "uuid": self.uuids[product],
+                "name": self.names[product],
+                "category": None if self.category_codes[product] < 0 else self.categories[self.category_codes[product]],
+                "image": self.images[product],
+                "price": None if np.isnan(self.prices[product]) else float(self.prices[product]),
+                "stock": None if self.stock[product] < 0 else int(self.stock[product]),
+            }
+            for product in selected
+        ]
+
+    def category_listing(self, category, facets=()):
+        """
+        Returns the unfiltered /api/category listing: price range, facet ranges and products ordered by (price, uuid).
+
+        :param category: category name
+        :param facets: numeric facets of the category
+        :return: dict or None if the category has no products
+        """
+        selected = np.flatnonzero(self.category_mask(category) & self.has_specs & (self.shops_min_prices > 0))
+        prices = self.prices[selected]
+        if not len(selected) or np.isnan(prices).all():
+            return None
+
+        data = {"min_price": float(np.nanmin(prices)), "max_price": float(np.nanmax(prices))}
+        for facet in facets:
+            values = self.facets[facet][selected] if facet in self.facets else np.empty(0)
+            values = values[~np.isnan(values)]
+            data[f"min_{facet}"] = int(values.min()) if len(values) else None
+            data[f"max_{facet}"] = int(values.max()) if len(values) else None
+
+        # NULL prices last, as PostgreSQL does
+        order = np.lexsort((np.array([self.uuids[product] for product in selected.tolist()]), np.nan_to_num(prices, nan=np.inf)))
+        data["products"] = [
+            {
+                "uuid": self.uuids[product],
+                "name": self.names[product],
+                "refurbished": bool(self.refurbished[product]),
+                "image": self.images[product],
+                "specs": self.specs[product],
+                "shops": self.shops_lists[product],
+                "price": None if np.isnan(self.prices[product]) else float(self.prices[product]),
+                "manufacturer": self.manufacturer_name(product),
+                "stock": None if self.stock[product] < 0 else int(self.stock[product]),
+            }
+            for product in selected[order].tolist()
+        ]
+        return data
+
+    def build_listing(self, category):
+        """
+        Returns the unfiltered /api/categories listing ordered by the min availability price.
+
+        :param category: category name
+        :return: list of products
+        """
+        mask = self.category_mask(category) & ~self.deleted & self.has_specs & (self.availabilities_min_prices > 0)
+        selected = np.flatnonzero(mask)
+        order = np.argsort(self.availabilities_min_prices[selected], kind="stable")
+
+        return [
+            {
+                "uuid": self.uuids[product],
+                "name": self.names[product],
+                "refurbished": bool(self.refurbished[product]),
+                "specifications": self.specs[product],
+                "availabilities": self.availabilities[product],
+                "manufacturer": self.manufacturer_name(product),
+                "image": self.images[product],
+            }
+            for product in selected[order].tolist()
+        ]
+
+    def manufacturer_name(self, product):
+        code = self.manufacturer_codes[product]
+        return None if code < 0 else self.manufacturers[code]
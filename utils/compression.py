@@ -0,0 +1,89 @@
+import gzip
+import logging
+import os
+from http import HTTPStatus
+
+from flask import g, request
+from utils.response_cache import response_cache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.propagate = True
+
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", 1024))  # Bytes
+COMPRESSION_GZIP_LEVEL = int(os.environ.get("COMPRESSION_GZIP_LEVEL", 6))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get("COMPRESSION_BROTLI_QUALITY", 5))
+
+# Preferred first
+CONTENT_ENCODINGS = ("br", "gzip") if brotli else ("gzip",)
+
+
+def negotiate_encoding():
+    """
+    Returns the best content encoding accepted by the client (Accept-Encoding, q values included).
+
+    :return: "br", "gzip" or None
+    """
+    return request.accept_encodings.best_match(CONTENT_ENCODINGS)
+
+
+def compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=COMPRESSION_GZIP_LEVEL)
+
+
+def variant_etag(response, encoding):
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak)
+
+
+def compress_response(response):
+    """
+    Compresses JSON responses with the encoding negotiated with the client.
+    Responses served from the response cache keep their compressed body in the cache entry,
+    so each variant is compressed once per cached value.
+    """
+    # 304 answers carry the ETag the 200 response would have had
+    if response.status_code == HTTPStatus.NOT_MODIFIED:
+        response.vary.add("Accept-Encoding")
+        encoding = negotiate_encoding()
+        if encoding:
+            variant_etag(response, encoding)
+        return response
+
+    if response.mimetype != "application/json" or response.direct_passthrough or response.is_streamed:
+        return response
+
+    response.vary.add("Accept-Encoding")
+    if "Content-Encoding" in response.headers:
+        return response
+
+    encoding = negotiate_encoding()
+    if not encoding:
+        return response
+
+    if response.status_code != HTTPStatus.OK or response.calculate_content_length() < COMPRESSION_MIN_SIZE:
+        return response
+
+    cache_entry = g.get("response_cache_entry", None)
+    body = response_cache.local.get_variant(*cache_entry, encoding) if cache_entry else None
+    if body is None:
+        body = compress(response.get_data(), encoding)
+        if cache_entry:
+            response_cache.local.set_variant(*cache_entry, encoding, body)
+
+    response.set_data(body)
+    response.headers["Content-Encoding"] = encoding
+    variant_etag(response, encoding)
+    return response
+
+
+def init_compression(app):
+    app.after_request(compress_response)
@@ -0,0 +1,60 @@
+import functools
+import logging
+from http import HTTPStatus
+
+from database.db_management.catalog_management import get_catalog_version
+from flask import make_response, request
+from utils.compression import CONTENT_ENCODINGS
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.propagate = True
+
+
+def catalog_etag_value(version):
+    """
+    Returns the (unquoted) strong ETag of a catalog response. ETags are scoped to the URL,
+    so the catalog version is enough to tell two representations of the same URL apart.
+
+    :param version: catalog version stamp
+    :return: string
+    """
+    return f"catalog-{version}"
+
+
+def etag_matches(etag):
+    """
+    Returns whether the If-None-Match header matches the ETag or one of its compressed variants.
+
+    :param etag: unquoted ETag
+    :return: bool
+    """
+    variants = (etag,) + tuple(f"{etag}-{encoding}" for encoding in CONTENT_ENCODINGS)
+    return any(request.if_none_match.contains(variant) for variant in variants)
+
+
+def catalog_etag(view):
+    """
+    Adds a strong ETag derived from the catalog version to the view responses and
+    answers 304 Not Modified to matching If-None-Match headers without running the view.
+    """
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        version = get_catalog_version()
+        if version is None:
+            return view(*args, **kwargs)
+
+        etag = catalog_etag_value(version)
+        if etag_matches(etag):
+            response = make_response("", HTTPStatus.NOT_MODIFIED)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != HTTPStatus.OK:
+                return response
+
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    return wrapper
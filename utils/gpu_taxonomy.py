@@ -0,0 +1,70 @@
+import re
+from collections import namedtuple
+
+# Base Models (Insensitive to TI or LHR)
+GPU_MODEL_REGEX = re.compile(r"RTX \d+(?: Ti)?|RX \d+ XT[X]?|RX \d+", re.IGNORECASE)
+GPU_FAMILY_REGEX = re.compile(r"RTX \d+|RX \d+", re.IGNORECASE)
+GPU_NUMBER_REGEX = re.compile(r"\d\d\d\d")
+
+GpuModel = namedtuple("GpuModel", ["model", "family", "number", "manufacturer"])
+
+
+def normalize_gpu_model(value):
+    """
+    Returns the normalized model of a GPU spec value.
+
+    :example:
+    >>> normalize_gpu_model("GeForce RTX 3060 Ti LHR")
+    GpuModel(model='RTX 3060 Ti', family='RTX 3060', number=3060, manufacturer='NVIDIA')
+    >>> normalize_gpu_model("Radeon RX 7900 XTX")
+    GpuModel(model='RX 7900 XTX', family='RX 7900', number=7900, manufacturer='AMD')
+    >>> normalize_gpu_model("Quadro T400")
+
+    :param value: product_specs.value of the GPU model spec
+    :return: GpuModel or None if the value is not a known GPU model
+    """
+    model = GPU_MODEL_REGEX.search(value)
+    if not model:
+        return None
+    model = model.group(0)
+
+    family = GPU_FAMILY_REGEX.search(model)
+    if not family:
+        return None
+    family = family.group(0)
+
+    number = GPU_NUMBER_REGEX.search(family)
+    if not number:
+        return None
+
+    manufacturer = "NVIDIA" if family.find("RTX") != -1 else "AMD"
+    return GpuModel(model, family, int(number.group(0)), manufacturer)
+
+
+class GpuTaxonomy:
+    """
+    Maps every GPU spec value of the catalog to its normalized model.
+    It is built once per catalog version, requests only do dictionary lookups.
+    """
+
+    def __init__(self, values):
+        self.models = {}
+        for value in values:
+            gpu = normalize_gpu_model(value)
+            if gpu:
+                self.models[value] = gpu
+
+    def __len__(self):
+        return len(self.models)
+
+    def lookup(self, value):
+        return self.models.get(value, None)
+
+    def arrays(self):
+        """
+        Returns the (values, models) arrays to join the taxonomy in SQL (unnest).
+
+        :return: tuple of lists
+        """
+        values = list(self.models)
+        return values, [self.models[value].model for value in values]
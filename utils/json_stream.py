@@ -0,0 +1,65 @@
+import logging
+import os
+from uuid import uuid4
+
+from database.db_connection import sql_connection
+from flask import Response, stream_with_context
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.propagate = True
+
+STREAM_BATCH_SIZE = int(os.environ.get("CATALOG_STREAM_BATCH_SIZE", 500))
+
+STREAM_TRUE_VALUES = ("1", "true", "yes")
+
+
+def stream_requested(args):
+    """
+    Returns whether the client asked for the streaming mode (?stream=1).
+
+    :param args: request query arguments
+    :return: bool
+    """
+    return str(args.get("stream", "")).lower() in STREAM_TRUE_VALUES
+
+
+def stream_json_rows(query, params=None, prefix="[", suffix="]", batch_size=STREAM_BATCH_SIZE):
+    """
+    Yields a JSON array whose items are the rows of the query, read in batches through a server-side named cursor.
+    The query must return a single json/text column per row, it is written as is (never parsed in Python).
+
+    :param query: SQL query returning one JSON document per row
+    :param params: query parameters
+    :param prefix: text written before the first item
+    :param suffix: text written after the last item
+    :param batch_size: rows fetched per round trip
+    """
+    yield prefix
+
+    with sql_connection(readonly=True) as connection:
+        with connection.cursor(name=f"stream_{uuid4().hex}") as cursor:
+            cursor.itersize = batch_size
+            cursor.execute(query, params)
+
+            separator = ""
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+
+                yield separator + ",".join(row[0] for row in rows)
+                separator = ","
+
+    yield suffix
+
+
+def json_stream_response(generator):
+    """
+    Returns a chunked application/json response consuming the generator.
+    The request context is kept alive while streaming.
+
+    :param generator: generator of JSON text chunks
+    :return: flask Response
+    """
+    return Response(stream_with_context(generator), mimetype="application/json")
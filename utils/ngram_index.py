@@ -0,0 +1,101 @@
+import re
+
+import numpy as np
+
+WORD_REGEX = re.compile(r"\w+")
+
+
+def trigrams(text):
+    """
+    Returns the trigrams of a text the way pg_trgm extracts them: lowercase words padded with
+    two spaces before and one after.
+
+    :example:
+    >>> sorted(trigrams("RTX"))
+    ['  r', ' rt', 'rtx', 'tx ']
+
+    :param text: string
+    :return: set of trigrams
+    """
+    result = set()
+    for word in WORD_REGEX.findall(text.lower()):
+        padded = f"  {word} "
+        for i in range(len(padded) - 2):
+            result.add(padded[i : i + 3])
+    return result
+
+
+class NgramIndex:
+    """
+    In-process trigram index of the product names, used by /api/search when pg_trgm is not installed.
+    Products are ranked by the share of the query trigrams found in their name.
+
+    Posting lists are int32 arrays: a search counts the hits of every product with one bincount
+    and ranks the matches with array operations, no per-candidate Python work.
+    """
+
+    def __init__(self, products, threshold=0.5, version=None):
+        """
+        :param products: list of dicts with at least "name" and "category"
+        :param threshold: min share of the query trigrams a name must contain
+        :param version: catalog version of the products
+        """
+        self.products = products
+        self.version = version
+        self.threshold = threshold
+
+        postings = {}
+        for position, product in enumerate(products):
+            for trigram in trigrams(product["name"] or ""):
+                postings.setdefault(trigram, []).append(position)
+        self.postings = {trigram: np.array(positions, dtype=np.int32) for trigram, positions in postings.items()}
+
+        categories = sorted({product["category"] for product in products if product["category"] is not None})
+        self.category_index = {category: code for code, category in enumerate(categories)}
+        self.category_codes = np.array([self.category_index.get(product["category"], -1) for product in products], dtype=np.int32)
+        self.name_lengths = np.array([len(product["name"] or "") for product in products], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.products)
+
+    def search(self, query, limit, category=None):
+        """
+        Returns the products whose names match the query best.
+
+        :example:
+        >>> index = NgramIndex([{"name": "MSI GeForce RTX 3060", "category": "GPU"}, {"name": "Corsair 750W", "category": "PSU"}])
+        >>> [product["name"] for product in index.search("rtx 3060", 10)]
+        ['MSI GeForce RTX 3060']
+        >>> index.search("rtx 3060", 10, category="PSU")
+        []
+
+        :param query: text to search
+        :param limit: max number of products
+        :param category: only products of this category
+        :return: list of products, best match first
+        """
+        query_trigrams = trigrams(query)
+        if not query_trigrams or limit <= 0:
+            return []
+
+        postings = [self.postings[trigram] for trigram in query_trigrams if trigram in self.postings]
+        min_hits = self.threshold * len(query_trigrams)
+        if len(postings) < min_hits:
+            return []
+
+        counts = np.bincount(np.concatenate(postings), minlength=len(self.products))
+        matches = counts >= min_hits
+        if category:
+            matches &= self.category_codes == self.category_index.get(category, -2)
+        positions = np.flatnonzero(matches)
+        if not len(positions):
+            return []
+
+        # Best score first, shorter names first on ties, then the index order: a single integer key
+        max_length = int(self.name_lengths[positions].max()) + 1
+        keys = ((len(query_trigrams) - counts[positions]) * max_length + self.name_lengths[positions]) * len(self.products) + positions
+        if len(keys) > limit:
+            keys = keys[np.argpartition(keys, limit - 1)[:limit]]
+        keys.sort()
+
+        return [self.products[position] for position in (keys % len(self.products)).tolist()]
@@ -0,0 +1,59 @@
+import base64
+import binascii
+import json
+import os
+
+PAGE_MAX_LIMIT = int(os.environ.get("CATALOG_PAGE_MAX_LIMIT", 100))
+
+
+def encode_cursor(price, uuid):
+    """
+    Returns the opaque cursor pointing after the (price, uuid) product.
+
+    :param price: price of the last product of the page (None if it has no price)
+    :param uuid: uuid of the last product of the page
+    :return: url safe string
+    """
+    data = json.dumps([None if price is None else str(price), str(uuid)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Returns the (price, uuid) pair stored in a cursor. The price is kept as text so no precision is lost.
+
+    :param cursor: string returned by encode_cursor
+    :return: tuple (price or None, uuid)
+    """
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        price, uuid = json.loads(base64.urlsafe_b64decode(cursor + padding))
+        if price is not None:
+            float(price)
+            price = str(price)
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+    return price, str(uuid)
+
+
+def parse_page_args(args):
+    """
+    Returns the keyset pagination parameters of a request (?limit=&after=).
+    Without limit the whole listing is returned, as before.
+
+    :param args: request query arguments
+    :return: tuple (limit or None, (price, uuid) or None)
+    """
+    limit = args.get("limit", None)
+    after = args.get("after", None)
+    if limit is None:
+        if after:
+            raise ValueError("after requires limit")
+        return None, None
+
+    limit = int(limit)
+    if limit < 1:
+        raise ValueError(f"Invalid limit: {limit}")
+
+    return min(limit, PAGE_MAX_LIMIT), decode_cursor(after) if after else None
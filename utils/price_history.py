@@ -0,0 +1,106 @@
+import datetime
+
+import numpy as np
+
+## Columns of the pivoted Flux records which are not shops
+FLUX_RECORD_COLUMNS = ("result", "table", "_time")
+
+
+def price_history_rows(records):
+    """
+    Returns the rows of a price history already pivoted by Flux (aggregateWindow with timeSrc "_start").
+
+    :param records: iterable of FluxRecord ordered by _time
+    :return: generator of (day ordinal, {shop: price})
+    """
+    for record in records:
+        prices = {column: value for column, value in record.values.items() if column not in FLUX_RECORD_COLUMNS}
+        yield record.values["_time"].date().toordinal(), prices
+
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling: keeps the first and last points and, of every bucket
+    in between, the point forming the largest triangle with the previous kept point and the average
+    of the next bucket.
+
+    :param x: array of increasing x values
+    :param y: array of y values
+    :param threshold: number of points to keep
+    :return: int array of the indices of the kept points
+    """
+    length = len(x)
+    if threshold >= length:
+        return np.arange(length)
+    if threshold <= 2:
+        return np.array([0, length - 1][:threshold], dtype=np.intp)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    buckets = threshold - 2
+    # Bucket i holds the points [bounds[i], bounds[i + 1]), the first and last points are buckets of their own
+    bounds = np.arange(buckets + 1) * (length - 2) // buckets + 1
+    bounds = np.append(bounds, length)
+
+    selected = np.empty(threshold, dtype=np.intp)
+    selected[0] = 0
+    previous = 0
+    for bucket in range(buckets):
+        start, end = bounds[bucket], bounds[bucket + 1]
+        next_end = bounds[bucket + 2]
+        average_x = x[end:next_end].mean()
+        average_y = y[end:next_end].mean()
+
+        areas = np.abs((x[previous] - average_x) * (y[start:end] - y[previous]) - (x[previous] - x[start:end]) * (average_y - y[previous]))
+        previous = start + int(areas.argmax())
+        selected[bucket + 1] = previous
+
+    selected[-1] = length - 1
+    return selected
+
+
+def compact_history_chart(days, shops, prices, points=None):
+    """
+    Returns the compact chart data of a price history: every shop only has the days it has a price,
+    as offsets from the first day, optionally downsampled to the given number of points (LTTB).
+
+    :param days: int array of day ordinals
+    :param shops: list of shops (rows of prices)
+    :param prices: float array shops x days (NaN without price)
+    :param points: max points of every shop, None to keep all of them
+    :return: dictionary {"start": first day, "datasets": [{"label": shop, "days": [...], "data": [...]}]}
+    """
+    if not len(days):
+        return {"start": None, "datasets": []}
+
+    start = int(days[0])
+    datasets = []
+    for shop, shop_prices in zip(shops, prices):
+        with_price = ~np.isnan(shop_prices)
+        if not with_price.any():
+            continue
+
+        shop_days = days[with_price]
+        shop_prices = shop_prices[with_price]
+        if points:
+            kept = lttb(shop_days, shop_prices, points)
+            shop_days = shop_days[kept]
+            shop_prices = shop_prices[kept]
+
+        datasets.append({"label": shop, "days": (shop_days - start).tolist(), "data": shop_prices.tolist()})
+
+    return {"start": datetime.date.fromordinal(start).isoformat(), "datasets": datasets}
+
+
+def price_history_rows_by_uuid(records):
+    """
+    Returns the rows of the price histories of several products already pivoted by Flux (grouped by uuid).
+
+    :param records: iterable of FluxRecord ordered by _time within every uuid
+    :return: dictionary {uuid: [(day ordinal, {shop: price})]}
+    """
+    histories = {}
+    for record in records:
+        prices = {column: value for column, value in record.values.items() if column not in FLUX_RECORD_COLUMNS and column != "uuid"}
+        histories.setdefault(record.values["uuid"], []).append((record.values["_time"].date().toordinal(), prices))
+    return histories
@@ -0,0 +1,233 @@
+import datetime
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.propagate = True
+
+PRICE_HISTORY_DAYS = int(os.environ.get("PRICE_HISTORY_DAYS", 365))
+PRICE_HISTORY_CACHE_MAX_ENTRIES = int(os.environ.get("PRICE_HISTORY_CACHE_MAX_ENTRIES", 2048))
+PRICE_HISTORY_CACHE_DIR = os.environ.get("PRICE_HISTORY_CACHE_DIR", "")
+
+## First day read when the whole history is requested
+PRICE_HISTORY_FIRST_DAY = datetime.date(1970, 1, 1).toordinal()
+
+
+class PriceHistory:
+    """
+    Finalized daily min prices of a product: a shops x days matrix (NaN without price), the ordinal
+    of the first day it covers and the ordinal of the first day which is not finalized yet.
+    """
+
+    __slots__ = ("days", "shops", "prices", "first_day", "finalized_until")
+
+    def __init__(self, days, shops, prices, first_day, finalized_until):
+        self.days = days
+        self.shops = shops
+        self.prices = prices
+        self.first_day = first_day
+        self.finalized_until = finalized_until
+
+    def aligned_prices(self, shops):
+        """
+        Returns the prices matrix with one row per shop of the list (NaN rows for shops it does not have).
+        """
+        prices = np.full((len(shops), len(self.days)), np.nan)
+        index = {shop: row for row, shop in enumerate(shops)}
+        for row, shop in enumerate(self.shops):
+            prices[index[shop]] = self.prices[row]
+        return prices
+
+
+def rows_matrix(rows, shops):
+    """
+    Returns the days and the shops x days prices matrix of the rows.
+
+    :param rows: list of (day ordinal, {shop: price})
+    :param shops: list of shops (rows of the matrix)
+    :return: tuple (int32 array of days, float array of prices)
+    """
+    index = {shop: row for row, shop in enumerate(shops)}
+    prices = np.full((len(shops), len(rows)), np.nan)
+    for column, (_, shop_prices) in enumerate(rows):
+        for shop, price in shop_prices.items():
+            if price is not None:
+                prices[index[shop], column] = price
+    return np.array([day for day, _ in rows], dtype=np.int32), prices
+
+
+def history_chart(days, shops, prices):
+    """
+    Returns the chart data of /api/product: one label per day and one dataset per shop with a price.
+    """
+    with_prices = ~np.isnan(prices).all(axis=1)
+    data = prices[with_prices].astype(object)
+    data[np.isnan(prices[with_prices])] = None
+
+    labels = [datetime.date.fromordinal(day).isoformat() for day in days.tolist()]
+    shops = [shop for shop, selected in zip(shops, with_prices.tolist()) if selected]
+    return {"labels": labels, "datasets": [{"label": shop, "data": shop_data} for shop, shop_data in zip(shops, data.tolist())]}
+
+
+class PriceHistoryCache:
+    """
+    Daily price history of the products by uuid. The days before today never change, so they are kept
+    (in memory, LRU, and optionally in PRICE_HISTORY_CACHE_DIR) and only the days since the last
+    finalized one are fetched again.
+    """
+
+    def __init__(self, max_entries, directory=""):
+        self.max_entries = max_entries
+        self.directory = directory
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def lookup(self, uuid):
+        with self._lock:
+            history = self._entries.get(uuid)
+            if history is not None:
+                self._entries.move_to_end(uuid)
+                return history
+
+        if not self.directory:
+            return None
+
+        try:
+            with np.load(self.path(uuid), allow_pickle=False) as data:
+                history = PriceHistory(data["days"], data["shops"].tolist(), data["prices"], int(data["first_day"]), int(data["finalized_until"]))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Histórico de precios en disco no válido {uuid}: {e}")
+            return None
+
+        self.remember(uuid, history)
+        return history
+
+    def store(self, uuid, history):
+        self.remember(uuid, history)
+        if not self.directory:
+            return
+
+        # Written to a temporary file and renamed, readers never see a partial file
+        path = self.path(uuid)
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temporary_path, "wb") as file:
+                np.savez(
+                    file,
+                    days=history.days,
+                    shops=np.array(history.shops, dtype=str),
+                    prices=history.prices,
+                    first_day=history.first_day,
+                    finalized_until=history.finalized_until,
+                )
+            os.replace(temporary_path, path)
+        except OSError as e:
+            logger.warning(f"No se ha podido guardar el histórico de precios {uuid}: {e}")
+
+    def remember(self, uuid, history):
+        with self._lock:
+            self._entries[uuid] = history
+            self._entries.move_to_end(uuid)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def path(self, uuid):
+        return os.path.join(self.directory, f"{uuid}.npz")
+
+    def get_history(self, uuid, fetch, days=PRICE_HISTORY_DAYS):
+        """
+        Returns the history of the last days of the product, fetching only the days that are not finalized.
+        The cached days before the requested ones are kept, so every range is served from the widest one read.
+
+        :param uuid: product uuid
+        :param fetch: function receiving the first day (UTC date) and returning (day ordinal, {shop: price}) rows
+        :param days: days of history, None for the whole history
+        :return: tuple (int32 array of days, list of shops, float array of prices shops x days)
+        """
+        return self.get_histories([uuid], lambda uuids, start: {uuid: fetch(start)}, days)[uuid]
+
+    def get_histories(self, uuids, fetch, days=PRICE_HISTORY_DAYS):
+        """
+        Returns the histories of several products with at most two fetches: the products without cached
+        history from the first requested day and the cached ones from the first day any of them did not finalize.
+
+        :param uuids: list of product uuids
+        :param fetch: function receiving the uuids and the first day (UTC date) and returning {uuid: [(day ordinal, {shop: price})]}
+        :param days: days of history, None for the whole history
+        :return: dictionary {uuid: (int32 array of days, list of shops, float array of prices shops x days)}
+        """
+        today = datetime.datetime.now(datetime.timezone.utc).date().toordinal()
+        first_day = today - days if days else PRICE_HISTORY_FIRST_DAY
+
+        cached = {}
+        for uuid in uuids:
+            history = self.lookup(uuid)
+            if history is None or history.first_day > first_day or history.finalized_until <= first_day:
+                cached[uuid] = (None, first_day)
+            else:
+                cached[uuid] = (history, history.finalized_until)
+
+        rows_by_uuid = {}
+        cold = [uuid for uuid, (history, _) in cached.items() if history is None]
+        if cold:
+            rows_by_uuid.update(fetch(cold, datetime.date.fromordinal(first_day)))
+        warm = [uuid for uuid, (history, _) in cached.items() if history is not None]
+        if warm:
+            rows_by_uuid.update(fetch(warm, datetime.date.fromordinal(min(cached[uuid][1] for uuid in warm))))
+
+        histories = {}
+        for uuid, (history, start_day) in cached.items():
+            rows = [row for row in rows_by_uuid.get(uuid, ()) if row[0] >= start_day]
+            histories[uuid] = self.update(uuid, history, start_day, rows, first_day, today)
+        return histories
+
+    def update(self, uuid, history, start_day, rows, first_day, today):
+        """
+        Adds the rows read since start_day to the cached history (None if there is none) of the product,
+        stores the finalized days and returns the requested days.
+        """
+        rows = list(rows)
+        if not rows and history is None:
+            # Nothing to keep (e.g. a uuid that is not a product), no cache entry nor file is created
+            return np.array([], dtype=np.int32), [], np.empty((0, 0))
+
+        finalized_rows = [row for row in rows if row[0] < today]
+        open_rows = [row for row in rows if row[0] >= today]
+
+        shops = {shop for _, shop_prices in rows for shop, price in shop_prices.items() if price is not None}
+        if history is not None:
+            shops.update(history.shops)
+        shops = sorted(shops)
+
+        days_array, prices = rows_matrix(finalized_rows, shops)
+        if history is not None:
+            kept = history.days < start_day
+            days_array = np.concatenate((history.days[kept], days_array))
+            prices = np.hstack((history.aligned_prices(shops)[:, kept], prices))
+            first_day_cached = history.first_day
+        else:
+            first_day_cached = start_day
+
+        # Warm hits only read the current day, the finalized days did not change
+        if history is None or history.finalized_until != today:
+            self.store(uuid, PriceHistory(days_array, shops, prices, first_day_cached, today))
+
+        open_days, open_prices = rows_matrix(open_rows, shops)
+        days_array = np.concatenate((days_array, open_days))
+        prices = np.hstack((prices, open_prices))
+
+        requested = days_array >= first_day
+        return days_array[requested], shops, prices[:, requested]
+
+
+price_history_cache = PriceHistoryCache(PRICE_HISTORY_CACHE_MAX_ENTRIES, PRICE_HISTORY_CACHE_DIR)
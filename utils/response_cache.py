@@ -0,0 +1,291 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import urlencode
+
+from database.db_management.catalog_management import get_catalog_version
+from flask import copy_current_request_context, current_app, g, request
+from utils.json_stream import stream_requested
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.propagate = True
+
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", 60))  # Seconds
+RESPONSE_CACHE_STALE_TTL = float(os.environ.get("RESPONSE_CACHE_STALE_TTL", 300))  # Seconds
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 512))
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+RESPONSE_CACHE_REDIS_URL = os.environ.get("RESPONSE_CACHE_REDIS_URL", "")
+
+
+class LRUCache:
+    """
+    In-process cache bounded by number of entries and by the size of the JSON encoded values.
+    Every entry can also hold encoded variants of its value (serialized / compressed bodies),
+    they are dropped with the entry.
+    """
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> [stored_at, size, value, variants]
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0], entry[2]
+
+    def set(self, key, stored_at, value, size):
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous:
+                self._bytes -= previous[1]
+
+            self._entries[key] = [stored_at, size, value, {}]
+            self._bytes += size
+            self._evict()
+
+    def get_variant(self, key, value, name):
+        """
+        Returns the variant of the entry if it still holds that same value object.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] is not value:
+                return None
+            return entry[3].get(name)
+
+    def set_variant(self, key, value, name, data):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] is not value or name in entry[3]:
+                return
+
+            entry[3][name] = data
+            entry[1] += len(data)
+            self._bytes += len(data)
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+class RedisBackend:
+    """
+    Cache shared by every worker (and every host) through Redis.
+    Redis errors are logged and treated as cache misses.
+    """
+
+    PREFIX = "response_cache:"
+
+    def __init__(self, url, expire):
+        self.expire = max(int(expire), 1)
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        try:
+            raw = self._client.get(self.PREFIX + key)
+        except redis.RedisError as e:
+            logger.warning(f"Redis no disponible: {e}")
+            return None
+
+        if raw is None:
+            return None
+        data = json.loads(raw)
+        return data["stored_at"], data["value"]
+
+    def set(self, key, stored_at, encoded_value):
+        try:
+            self._client.set(self.PREFIX + key, '{"stored_at": %s, "value": %s}' % (json.dumps(stored_at), encoded_value), ex=self.expire)
+        except redis.RedisError as e:
+            logger.warning(f"Redis no disponible: {e}")
+
+
+class ResponseCache:
+    """
+    Two level response cache (in-process LRU + optional shared backend).
+
+    - Fresh entries (younger than ttl) are served directly.
+    - Stale entries (younger than ttl + stale_ttl) are served while a background thread recomputes them.
+    - Misses are computed once per key: concurrent requests for the same key wait for that computation.
+    """
+
+    def __init__(self, ttl, stale_ttl, local, shared=None):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.local = local
+        self.shared = shared
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._refreshing = set()
+
+    def lookup(self, key):
+        entry = self.local.get(key)
+        if entry is None and self.shared is not None:
+            entry = self.shared.get(key)
+            if entry is not None:
+                self.local.set(key, entry[0], entry[1], len(json.dumps(entry[1])))
+        return entry
+
+    def store(self, key, value):
+        if not isinstance(value, (dict, list)):
+            return
+
+        try:
+            encoded_value = json.dumps(value)
+        except TypeError as e:
+            logger.warning(f"Respuesta no cacheable {key}: {e}")
+            return
+
+        stored_at = time.time()
+        self.local.set(key, stored_at, value, len(encoded_value))
+        if self.shared is not None:
+            self.shared.set(key, stored_at, encoded_value)
+
+    def get_or_compute(self, key, compute, wrap_background=None):
+        """
+        Returns the cached value of the key, computing it if needed.
+
+        :param key: cache key
+        :param compute: function returning the value
+        :param wrap_background: decorator applied to compute before running it in a background thread
+        :return: value
+        """
+        entry = self.lookup(key)
+        if entry is not None:
+            age = time.time() - entry[0]
+            if age < self.ttl:
+                return entry[1]
+            if age < self.ttl + self.stale_ttl:
+                self._refresh_in_background(key, wrap_background(compute) if wrap_background else compute)
+                return entry[1]
+
+        with self._key_lock(key):
+            # Another request may have computed it while waiting
+            entry = self.lookup(key)
+            if entry is not None and time.time() - entry[0] < self.ttl:
+                return entry[1]
+
+            value = compute()
+            self.store(key, value)
+            return value
+
+    def clear(self):
+        self.local.clear()
+
+    @contextmanager
+    def _key_lock(self, key):
+        with self._locks_guard:
+            lock_entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            lock_entry[1] += 1
+
+        try:
+            with lock_entry[0]:
+                yield
+        finally:
+            with self._locks_guard:
+                lock_entry[1] -= 1
+                if lock_entry[1] == 0:
+                    self._locks.pop(key, None)
+
+    def _refresh_in_background(self, key, compute):
+        with self._locks_guard:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                with self._key_lock(key):
+                    self.store(key, compute())
+            except Exception as e:
+                logger.error(f"No se ha podido refrescar la caché de {key}: {e}")
+            finally:
+                with self._locks_guard:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+
+def build_response_cache():
+    shared = None
+    if RESPONSE_CACHE_REDIS_URL:
+        if redis is None:
+            logger.warning("RESPONSE_CACHE_REDIS_URL definido pero el paquete redis no está instalado")
+        else:
+            shared = RedisBackend(RESPONSE_CACHE_REDIS_URL, RESPONSE_CACHE_TTL + RESPONSE_CACHE_STALE_TTL)
+
+    local = LRUCache(RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_MAX_BYTES)
+    return ResponseCache(RESPONSE_CACHE_TTL, RESPONSE_CACHE_STALE_TTL, local, shared)
+
+
+response_cache = build_response_cache()
+
+
+def request_cache_key():
+    """
+    Returns the cache key of the current request: catalog version, endpoint, path and sorted query arguments.
+    A new catalog version never serves responses computed from the previous one.
+
+    :return: string
+    """
+    args = urlencode(sorted(request.args.items(multi=True)))
+    return f"{get_catalog_version()}:{request.endpoint}:{request.path}?{args}"
+
+
+def cached_response(view):
+    """
+    Caches the JSON (dict or list) returned by a GET view. Streaming requests are never cached.
+    The serialized body is kept with the entry, so it is encoded once per cached value.
+    """
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if stream_requested(request.args):
+            return view(*args, **kwargs)
+
+        def compute():
+            return view(*args, **kwargs)
+
+        # Stale entries are recomputed in a thread which needs a copy of the request (view arguments, query args)
+        key = request_cache_key()
+        value = response_cache.get_or_compute(key, compute, copy_current_request_context)
+        if not isinstance(value, (dict, list)):
+            return value
+
+        body = response_cache.local.get_variant(key, value, "identity")
+        if body is None:
+            body = (current_app.json.dumps(value) + "\n").encode()
+            response_cache.local.set_variant(key, value, "identity", body)
+
+        # The compression hook stores its variants in the same entry (utils/compression.py)
+        g.response_cache_entry = (key, value)
+        return current_app.response_class(body, mimetype="application/json")
+
+    return wrapper
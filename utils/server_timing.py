@@ -0,0 +1,35 @@
+import time
+
+from flask import g
+
+
+def timed_call(function, *args):
+    """
+    Runs the function and measures it, it can run in any thread.
+
+    :return: tuple (result, seconds)
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def add_timing(name, seconds):
+    """
+    Adds a stage duration to the Server-Timing header of the current response.
+
+    :param name: stage name
+    :param seconds: duration
+    """
+    g.setdefault("server_timings", []).append((name, seconds))
+
+
+def add_server_timing_header(response):
+    timings = g.get("server_timings", None)
+    if timings:
+        response.headers["Server-Timing"] = ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings)
+    return response
+
+
+def init_server_timing(app):
+    app.after_request(add_server_timing_header)
@@ -0,0 +1,148 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+from database.db_management.catalog_management import CATALOG_SNAPSHOT_ENABLED, CATALOG_VERSION_CHECK_INTERVAL, get_catalog_snapshot, get_catalog_version
+from utils.compression import CONTENT_ENCODINGS
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.propagate = True
+
+WARMUP_ENABLED = os.environ.get("WARMUP_ENABLED", "1") == "1"
+WARMUP_CONCURRENCY = int(os.environ.get("WARMUP_CONCURRENCY", 4))
+WARMUP_SNAPSHOT_TIMEOUT = float(os.environ.get("WARMUP_SNAPSHOT_TIMEOUT", 30))  # Seconds
+WARMUP_MAX_FAILED = int(os.environ.get("WARMUP_MAX_FAILED", 0))
+WARMUP_MAX_ATTEMPTS = int(os.environ.get("WARMUP_MAX_ATTEMPTS", 5))
+WARMUP_RETRY_DELAY = float(os.environ.get("WARMUP_RETRY_DELAY", 2))  # Seconds, doubled after every failed warm-up
+WARMUP_RETRY_MAX_DELAY = 60  # Seconds
+
+_ready = threading.Event()
+_warmup_started = False
+_warmup_lock = threading.Lock()
+
+
+def wait_for_snapshot():
+    """
+    Waits until the catalog snapshot of the current version is loaded, so the warm-up fills the caches
+    from it instead of from PostgreSQL.
+    """
+    if not CATALOG_SNAPSHOT_ENABLED:
+        return
+
+    deadline = time.monotonic() + WARMUP_SNAPSHOT_TIMEOUT
+    while get_catalog_snapshot() is None and time.monotonic() < deadline:
+        time.sleep(0.1)
+
+
+def warm_up(app, paths):
+    """
+    Requests every path through the application, once per content encoding, so the response cache
+    holds the responses and their compressed bodies.
+
+    :param app: Flask application
+    :param paths: list of GET paths
+    :return: number of paths that failed
+    """
+    start = time.monotonic()
+    wait_for_snapshot()
+
+    def warm(path):
+        try:
+            for encoding in CONTENT_ENCODINGS:
+                response = app.test_client().get(path, headers={"Accept-Encoding": encoding})
+                if response.status_code != HTTPStatus.OK:
+                    logger.warning(f"Warm-up de {path}: {response.status_code}")
+                    return False
+        except Exception as e:
+            logger.error(f"Warm-up de {path} fallido: {e}")
+            return False
+        return True
+
+    with ThreadPoolExecutor(max_workers=WARMUP_CONCURRENCY) as executor:
+        failed = list(executor.map(warm, paths)).count(False)
+
+    logger.info(f"Warm-up de {len(paths)} rutas en {time.monotonic() - start:.2f}s ({failed} fallidas)")
+    return failed
+
+
+def watch_catalog(app, paths):
+    """
+    Warms the caches up when the worker starts and every time the catalog version changes.
+    The worker reports ready after a warm-up with at most WARMUP_MAX_FAILED failed paths. Failed warm-ups
+    are retried with backoff, after WARMUP_MAX_ATTEMPTS of them the worker reports ready anyway.
+    """
+    warmed_version = None
+    attempts = 0
+    while True:
+        version = None
+        try:
+            version = get_catalog_version()
+            if _ready.is_set() and version == warmed_version:
+                time.sleep(CATALOG_VERSION_CHECK_INTERVAL)
+                continue
+
+            failed = warm_up(app, paths)
+        except Exception as e:
+            logger.error(f"Error en el warm-up: {e}")
+            failed = len(paths)
+
+        if failed <= WARMUP_MAX_FAILED:
+            warmed_version = version
+            attempts = 0
+            _ready.set()
+            time.sleep(CATALOG_VERSION_CHECK_INTERVAL)
+            continue
+
+        attempts += 1
+        if not _ready.is_set() and attempts >= WARMUP_MAX_ATTEMPTS:
+            logger.critical(f"Warm-up fallido {attempts} veces ({failed} rutas), el worker se marca listo sin caches")
+            _ready.set()
+
+        time.sleep(min(WARMUP_RETRY_DELAY * 2 ** (attempts - 1), WARMUP_RETRY_MAX_DELAY))
+
+
+def readiness():
+    """
+    Returns whether this worker finished its first warm-up.
+    """
+    if _ready.is_set():
+        return {"ready": True}
+    return {"ready": False}, HTTPStatus.SERVICE_UNAVAILABLE
+
+
+def init_warmup(app, paths):
+    """
+    Adds /api/ready and registers the paths warmed up by start_warmup(). Gunicorn imports the application
+    in every worker (no --preload), so each worker warms its own caches: gunicorn.conf.py starts the
+    warm-up in post_worker_init, before the worker accepts connections.
+
+    :param app: Flask application
+    :param paths: list of GET paths to warm up
+    """
+    app.add_url_rule("/api/ready", "ready", readiness, methods=["GET"])
+    app.extensions["warmup_paths"] = paths
+
+    if not WARMUP_ENABLED:
+        _ready.set()
+
+
+def start_warmup(app):
+    """
+    Starts the warm-up thread of the worker (first warm-up, then again on every catalog change).
+
+    :param app: Flask application passed to init_warmup()
+    :return: threading.Event set when the first warm-up is done
+    """
+    global _warmup_started
+
+    with _warmup_lock:
+        if not WARMUP_ENABLED or _warmup_started:
+            return _ready
+        _warmup_started = True
+
+    threading.Thread(target=watch_catalog, args=(app, app.extensions["warmup_paths"]), daemon=True).start()
+    return _ready